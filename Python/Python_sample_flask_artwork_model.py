@@ -7,22 +7,112 @@ This is a simple code snippet from an Artwork organization project similar to Ar
 A basic model that abstracts a Database Table full of artwork (Could be Postgres, Mysql, etc)
 """
 
-import random, 
+import secrets
 import re
 import json
+import math
+import base64
 import datetime
+import threading
+from collections import OrderedDict
 
 from sqlalchemy import func as sql_alchemy_func
+from sqlalchemy import tuple_
+from sqlalchemy import inspect as sql_alchemy_inspect
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Query, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.sql import expression
 from dateutil import parser
 from app import db, app
 
+_punct_re = re.compile(r'[^a-zA-Z0-9\-\_]+')
+_keyword_re = re.compile(r'[^a-zA-Z0-9,]')
+
+class ArtworkJSONCache(object):
+    """
+    Serialized get_json() payloads, one entry per artwork and output variant, tagged with the version
+    (the `updated` timestamp) they were built from. A version mismatch is a miss.
+    Entries are evicted least recently used past max_entries. An optional shared backend with
+    get / set / delete (Flask-Caching, cachelib, a redis wrapper) is consulted on local misses.
+    Cached payloads are shared, treat the nested artist and gallery values as read-only.
+    """
+
+    KEY_PREFIX = 'artwork-json'
+
+    def __init__(self, max_entries = 10000, backend = None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # (envelope_type, include_gallery) combinations get_json can be asked for.
+    VARIANTS = ((False, True), (True, True), (False, False), (True, False))
+
+    def _key(self, artwork_id, variant):
+        return '{}:{}:{}'.format(self.KEY_PREFIX, artwork_id, ''.join(str(int(bool(flag))) for flag in variant))
+
+    def get(self, artwork_id, version, variant = (False, True)):
+        key = self._key(artwork_id, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == version:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+
+        if self.backend is not None:
+            entry = self.backend.get(key)
+            if entry is not None and entry[0] == version:
+                self._store(key, entry)
+                return entry[1]
+        return None
+
+    def set(self, artwork_id, version, payload, variant = (False, True)):
+        key = self._key(artwork_id, variant)
+        entry = (version, payload)
+        self._store(key, entry)
+        if self.backend is not None:
+            self.backend.set(key, entry)
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def invalidate(self, artwork_id):
+        for variant in self.VARIANTS:
+            key = self._key(artwork_id, variant)
+            with self._lock:
+                self._entries.pop(key, None)
+            if self.backend is not None:
+                self.backend.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
 class Artwork(db.Model):
 
     __searchable__ = ['title', 'keywords']
+    __table_args__ = (
+        db.Index('ix_artwork_x_y', 'x', 'y'),
+        # Keyset feed indexes, partial on visible artworks where the database supports it. SQLite only
+        # uses a partial index when the query holds its WHERE terms as written, so these match how
+        # ~hidden and is_featured render there (SQLite has no boolean type).
+        db.Index('ix_artwork_feed_sort_order', 'sort_order', 'id', postgresql_where = db.text('NOT hidden'), sqlite_where = db.text('hidden = 0')),
+        db.Index('ix_artwork_feed_added', 'added', 'id', postgresql_where = db.text('NOT hidden'), sqlite_where = db.text('hidden = 0')),
+        db.Index('ix_artwork_feed_category', 'category', 'sort_order', 'id', postgresql_where = db.text('NOT hidden'), sqlite_where = db.text('hidden = 0')),
+        db.Index('ix_artwork_feed_featured', 'sort_order', 'id', postgresql_where = db.text('is_featured AND NOT hidden'), sqlite_where = db.text('is_featured = 1 AND hidden = 0')),
+        db.Index('ix_artwork_user_added', 'user_id', 'added', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.ForeignKey(u'user.id'), nullable = False, index = True)
+    # user.artwork loads every artwork of the user, page through large portfolios with Artwork.feed(user_id = ...).
     artist = db.relationship(u'User', backref='artwork', order_by="desc(Artwork.id)")
 
     unique_hash = db.Column(db.String(app.config['ARTWORK_UID_LENGTH']), index = True, unique = True, nullable = False)
@@ -30,16 +120,28 @@ class Artwork(db.Model):
     title = db.Column(db.Text, nullable = False)
     body = db.Column(db.Text) # Rich Text Format
     keywords = db.Column(db.String(255))
+    # Inverted index of the keywords above, kept in sync by set_keywords.
+    keyword_index = db.relationship(u'ArtworkKeyword', cascade='all, delete-orphan', passive_deletes=True)
     slug = db.Column(db.String(100), nullable = False )
 
     main_image = db.Column(db.String(255), nullable = False)
+    # Legacy JSON gallery, superseded by the artwork_image rows. Kept until migrate_gallery_table has run.
     gallery = db.Column(db.Text, default='[]')
+    images = db.relationship(u'ArtworkImage', order_by=u'ArtworkImage.position', cascade='all, delete-orphan', passive_deletes=True)
 
     added = db.Column(db.DateTime(timezone = True), default = sql_alchemy_func.now())
     updated = db.Column(db.DateTime(timezone = True), onupdate = sql_alchemy_func.now() )
 
     coords = db.Column(db.String(255), nullable = False)
 
+    # Numeric copies of coords for map queries, written by set_coords. grid_cell packs the
+    # GRID_CELL_SIZE square holding (x, y) into one indexed integer.
+    x = db.Column(db.Float, nullable = True)
+    y = db.Column(db.Float, nullable = True)
+    latest_x = db.Column(db.Float, nullable = True)
+    latest_y = db.Column(db.Float, nullable = True)
+    grid_cell = db.Column(db.BigInteger, nullable = True, index = True)
+
     model = db.Column(db.String(255), nullable=True, default = '' )
     model_type = db.Column(db.String(50), nullable = True) #sketchfab
     model_url = db.Column(db.String(255), nullable = True) #url
@@ -52,40 +154,147 @@ class Artwork(db.Model):
 
     hidden = db.Column(db.Boolean, server_default=expression.false(), nullable=False)
 
-    def __init__(self, artist):
+    # UIDs checked against the table per existence query.
+    UID_CHECK_CHUNK = 1000
+
+    # Artworks serialized per chunk when streaming a feed.
+    FEED_CHUNK = 500
+
+    # Shared by every Artwork. Set json_cache.backend to share entries between processes.
+    json_cache = ArtworkJSONCache(app.config.get('ARTWORK_JSON_CACHE_SIZE', 10000))
+
+    # Keyset feeds: 'sort_order' runs ascending (unsorted artworks last), 'added' runs newest first.
+    FEED_ORDERS = ('sort_order', 'added')
+    FEED_PAGE_SIZE = 50
+
+    # Spatial grid. Bounding boxes spanning more than GRID_MAX_CELLS cells use the (x, y) index instead.
+    GRID_CELL_SIZE = 256.0
+    GRID_BITS = 24
+    GRID_MAX_CELLS = 256
+
+    def __init__(self, artist, unique_hash = None):
         self.artist = artist
-        self.make_unique_hash()
+        if unique_hash:
+            self.unique_hash = unique_hash
+        else:
+            self.make_unique_hash()
 
     @property
     def uid(self):
         return self.unique_hash
 
     def make_unique_hash(self):
-        self.unqiue_hash = ''
-        existing = True
-        while existing:
-            self.unique_hash = ''.join(random.choice(string.hexdigits) for i in range(app.config['ARTWORK_UID_LENGTH']-1))
-            existing_unique_hash = Artwork.query.filter(Artwork.unique_hash == self.unique_hash).first()
-            if existing_unique_hash == None:
-                existing = False
-                break
-            else:
-                continue
-
+        self.unique_hash = Artwork.reserve_unique_hashes(1)[0]
         return self.unique_hash
 
-    def set_title_and_slug(self, title):
-        _punct_re = re.compile(r'[^a-zA-Z0-9\-\_]+')
+    @staticmethod
+    def generate_unique_hash():
+        # CSPRNG hex string, the UIDs are public.
+        length = app.config['ARTWORK_UID_LENGTH']-1
+        return secrets.token_hex((length + 1) // 2)[:length]
+
+    @classmethod
+    def reserve_unique_hashes(cls, count):
+        """
+        Allocate `count` UIDs no stored artwork uses yet, for bulk imports.
+        Candidates are checked with one IN query per UID_CHECK_CHUNK, only collisions are redrawn.
+        Nothing is locked, the unique constraint on unique_hash still guards concurrent inserts.
+        """
+        reserved = set()
+        while len(reserved) < count:
+            candidates = set(cls.generate_unique_hash() for i in range(count - len(reserved))) - reserved
+            candidates = list(candidates)
+
+            taken = set()
+            for start in range(0, len(candidates), cls.UID_CHECK_CHUNK):
+                chunk = candidates[start:start + cls.UID_CHECK_CHUNK]
+                # No autoflush, the artwork asking for a UID may not be complete yet.
+                with db.session.no_autoflush:
+                    rows = db.session.query(cls.unique_hash).filter(cls.unique_hash.in_(chunk)).all()
+                taken.update(row.unique_hash for row in rows)
+
+            reserved.update(uid for uid in candidates if uid not in taken)
+
+        return list(reserved)
+
+    @staticmethod
+    def make_slug(title):
         # Generates an ASCII-only slug.
         result = []
         for word in _punct_re.split(title.lower()):
             result.extend(word.split())
-        self.slug = str(u'-'.join(result))
+        return str(u'-'.join(result))
+
+    def set_title_and_slug(self, title):
+        self.slug = Artwork.make_slug(title)
         self.title = title
+        self.invalidate_json_cache()
+
+    @staticmethod
+    def clean_keywords(keywords):
+        return _keyword_re.sub('', keywords.replace(' ',''))
 
     def set_keywords(self, keywords):
-        keywords = keywords.replace(' ','')
-        self.keywords = re.sub(r'[^a-zA-Z0-9,]','', keywords)
+        self.keywords = Artwork.clean_keywords(keywords)
+        self.sync_keyword_index()
+        self.invalidate_json_cache()
+
+    def sync_keyword_index(self):
+        """ Bring the ArtworkKeyword rows in line with the keywords column, only the differences are written """
+        wanted = set(keyword.lower() for keyword in self.get_keywords() if keyword)
+        current = dict((row.keyword, row) for row in self.keyword_index)
+
+        for keyword, row in current.items():
+            if keyword not in wanted:
+                self.keyword_index.remove(row)
+        for keyword in sorted(wanted - set(current)):
+            self.keyword_index.append(ArtworkKeyword(keyword = keyword))
+
+    @classmethod
+    def rebuild_keyword_index(cls, chunk_size = 1000):
+        """ Backfill the keyword index from the keywords column, for rows written before it existed """
+        last_id = 0
+        while True:
+            artworks = cls.query.filter(cls.id > last_id).order_by(cls.id).limit(chunk_size).all()
+            if not artworks:
+                break
+            for artwork in artworks:
+                artwork.sync_keyword_index()
+            db.session.commit()
+            last_id = artworks[-1].id
+
+    @staticmethod
+    def normalize_keywords(keywords):
+        if isinstance(keywords, str):
+            keywords = keywords.split(',')
+        return set(re.sub(r'[^a-zA-Z0-9]','', keyword).lower() for keyword in keywords) - set([''])
+
+    @classmethod
+    def with_keywords(cls, keywords, match_all = True, query = None):
+        """
+        Artworks tagged with all (or with match_all = False, any) of the keywords, through the keyword index.
+        Keywords may be a list or a comma separated string. Narrows `query` when one is given.
+        """
+        query = query if query is not None else cls.query
+        keywords = cls.normalize_keywords(keywords)
+        if not keywords:
+            return query.filter(expression.false()) if not match_all else query
+
+        matching = db.session.query(ArtworkKeyword.artwork_id).filter(ArtworkKeyword.keyword.in_(keywords))
+        if match_all:
+            matching = matching.group_by(ArtworkKeyword.artwork_id).having(sql_alchemy_func.count(ArtworkKeyword.keyword) == len(keywords))
+        return query.filter(cls.id.in_(matching))
+
+    @classmethod
+    def keyword_counts(cls, limit = None, include_hidden = False):
+        """ (keyword, artwork count) pairs, most used first """
+        counts = db.session.query(ArtworkKeyword.keyword, sql_alchemy_func.count(ArtworkKeyword.artwork_id).label('artwork_count'))
+        if not include_hidden:
+            counts = counts.join(cls, cls.id == ArtworkKeyword.artwork_id).filter(cls.hidden == expression.false())
+        counts = counts.group_by(ArtworkKeyword.keyword).order_by(sql_alchemy_func.count(ArtworkKeyword.artwork_id).desc(), ArtworkKeyword.keyword)
+        if limit:
+            counts = counts.limit(limit)
+        return [(keyword, artwork_count) for keyword, artwork_count in counts]
 
     def get_keywords(self):
         if self.keywords:
@@ -97,18 +306,148 @@ class Artwork(db.Model):
             return self.keywords.replace(',',', ')
         return ''
 
+    def decoded_column(self, column_name, default):
+        """
+        Decode a JSON text column at most once per loaded value.
+        The decoded value is cached beside the raw text it came from, so any new value in the
+        column (setters, a refresh, a plain assignment) is picked up on the next call.
+        """
+        raw = getattr(self, column_name)
+        cache_name = '_{}_decoded'.format(column_name)
+        cached = getattr(self, cache_name, None)
+        if cached is None or cached[0] is not raw:
+            try:
+                cached = (raw, json.loads(raw))
+            except Exception as e:
+                if default is None:
+                    raise
+                cached = (raw, default)
+            setattr(self, cache_name, cached)
+        return cached[1]
+
     def get_coords(self):
-        return json.loads(self.coords)
+        return dict(self.decoded_column('coords', None))
 
     def set_coords(self, x, y, latest_x = 0, latest_y = 0):
-        self.coords = json.dumps({'x':x,'y':y, "latest_x":latest_x, "latest_y":latest_y})
+        coords = {'x':x,'y':y, "latest_x":latest_x, "latest_y":latest_y}
+        self.coords = json.dumps(coords)
+        self._coords_decoded = (self.coords, coords)
+
+        self.x = x
+        self.y = y
+        self.latest_x = latest_x
+        self.latest_y = latest_y
+        self.grid_cell = Artwork.grid_key(*Artwork.grid_position(x, y))
+        self.invalidate_json_cache()
+
+    @classmethod
+    def grid_position(cls, x, y):
+        return int(math.floor(x / cls.GRID_CELL_SIZE)), int(math.floor(y / cls.GRID_CELL_SIZE))
+
+    @classmethod
+    def grid_key(cls, cell_x, cell_y):
+        offset = 1 << (cls.GRID_BITS - 1)
+        return ((cell_x + offset) << cls.GRID_BITS) | (cell_y + offset)
+
+    @classmethod
+    def rebuild_spatial_index(cls, chunk_size = 1000):
+        """ Backfill the numeric coordinate columns from coords, for rows written before they existed """
+        last_id = 0
+        while True:
+            artworks = cls.query.filter(cls.id > last_id).order_by(cls.id).limit(chunk_size).all()
+            if not artworks:
+                break
+            for artwork in artworks:
+                coords = artwork.get_coords()
+                artwork.set_coords(coords['x'], coords['y'], coords.get('latest_x', 0), coords.get('latest_y', 0))
+            db.session.commit()
+            last_id = artworks[-1].id
+
+    @classmethod
+    def in_bounds(cls, min_x, min_y, max_x, max_y, query = None):
+        """
+        Query for the artworks whose (x, y) lies inside the bounding box, edges included.
+        Small boxes are looked up by grid cell, large ones through the (x, y) index.
+        """
+        query = query if query is not None else cls.query
+        query = query.filter(cls.x >= min_x, cls.x <= max_x, cls.y >= min_y, cls.y <= max_y)
+
+        min_cell_x, min_cell_y = cls.grid_position(min_x, min_y)
+        max_cell_x, max_cell_y = cls.grid_position(max_x, max_y)
+        cell_count = (max_cell_x - min_cell_x + 1) * (max_cell_y - min_cell_y + 1)
+        if cell_count <= cls.GRID_MAX_CELLS:
+            cells = [cls.grid_key(cell_x, cell_y) for cell_x in range(min_cell_x, max_cell_x + 1) for cell_y in range(min_cell_y, max_cell_y + 1)]
+            query = query.filter(cls.grid_cell.in_(cells))
+        return query
+
+    @classmethod
+    def nearest(cls, x, y, count = 10, max_rings = 64, query = None):
+        """
+        The `count` artworks closest to (x, y), nearest first, searching outwards one ring of grid cells
+        per query. Stops as soon as no unvisited cell can hold anything closer, or after max_rings rings.
+        """
+        query = query if query is not None else cls.query
+        center_x, center_y = cls.grid_position(x, y)
+
+        candidates = []
+        for ring in range(max_rings + 1):
+            cells = [cls.grid_key(center_x + cell_x, center_y + cell_y)
+                for cell_x in range(-ring, ring + 1) for cell_y in range(-ring, ring + 1)
+                if max(abs(cell_x), abs(cell_y)) == ring]
+            for artwork in query.filter(cls.grid_cell.in_(cells)):
+                candidates.append((math.hypot(artwork.x - x, artwork.y - y), artwork.id, artwork))
+
+            # Every cell outside this ring is at least ring cells away from (x, y).
+            if len(candidates) >= count:
+                candidates.sort(key = lambda candidate: candidate[:2])
+                if candidates[count - 1][0] <= ring * cls.GRID_CELL_SIZE:
+                    break
+
+        candidates.sort(key = lambda candidate: candidate[:2])
+        return [artwork for distance, artwork_id, artwork in candidates[:count]]
+
+    def invalidate_json_cache(self):
+        if self.id is not None:
+            Artwork.json_cache.invalidate(self.id)
+
+    @property
+    def json_version(self):
+        return self.updated.isoformat() if self.updated else None
+
+    def get_json(self, envelope_type = False, include_gallery = True):
+        """
+        The serialized artwork, served from json_cache while the row is unchanged.
+        include_gallery = False leaves the gallery out and never touches the artwork_image rows.
+        The artist is not versioned with the artwork, so it is added on every call rather than cached.
+        """
+        if self.id is None:
+            return self.build_json(envelope_type, include_gallery)
 
-    def get_json(self, envelope_type = False):
-        return {
+        version = self.json_version
+        variant = (envelope_type, include_gallery)
+        payload = Artwork.json_cache.get(self.id, version, variant)
+        if payload is None:
+            payload = self.build_artwork_json(envelope_type, include_gallery)
+            Artwork.json_cache.set(self.id, version, payload, variant)
+        return self.with_artist_json(payload)
+
+    def build_json(self, envelope_type = False, include_gallery = True):
+        return self.with_artist_json(self.build_artwork_json(envelope_type, include_gallery))
+
+    def with_artist_json(self, payload):
+        serialized = {
             'artist':{
                 'uid':self.artist.uid,
                 'username':self.artist.username
-            },
+            }
+        }
+        serialized.update(payload)
+        return serialized
+
+    def build_artwork_json(self, envelope_type = False, include_gallery = True):
+        """ Everything get_json returns apart from the artist, versioned by the artwork's `updated` """
+        coords = self.decoded_column('coords', None)
+        payload = {
             'id':self.id,
             'uid':self.uid,
             'main_image':self.main_image,
@@ -119,13 +458,12 @@ class Artwork(db.Model):
             'keywords':self.keywords,
             'unique_hash':self.unique_hash,
             'unique_id':self.unique_hash,
-            'gallery':self.get_gallery(),
-            'x':self.get_coords()['x'],
-            'y':self.get_coords()['y'],
+            'x':coords['x'],
+            'y':coords['y'],
             'slug':self.slug,
             'latest_image':self.main_image,
-            'latest_x':self.get_coords()['latest_x'] if 'latest_x' in self.get_coords() else 0,
-            'latest_y':self.get_coords()['latest_y'] if 'latest_y' in self.get_coords() else 0,
+            'latest_x':coords.get('latest_x', 0),
+            'latest_y':coords.get('latest_y', 0),
             'model':self.model,
             'model_type':self.model_type,
             'model_url':self.model_url,
@@ -133,14 +471,352 @@ class Artwork(db.Model):
             'category':self.category,
             'is_featured':self.is_featured
         }
+        if include_gallery:
+            payload['gallery'] = self.get_gallery()
+        return payload
+
+    @classmethod
+    def preload_artists(cls, artworks):
+        """
+        Load the artists of already loaded artworks with one query.
+        The users land in the session identity map, so reading artwork.artist afterwards issues no query.
+        Keep the returned list around while serializing, the identity map only holds weak references.
+        """
+        user_ids = set(artwork.user_id for artwork in artworks if 'artist' in sql_alchemy_inspect(artwork).unloaded)
+        if not user_ids:
+            return []
+
+        user_class = cls.artist.property.mapper.class_
+        return db.session.query(user_class).filter(user_class.id.in_(user_ids)).all()
+
+    @classmethod
+    def preload_images(cls, artworks):
+        """ Load the gallery images of already loaded artworks with one query """
+        pending = dict((artwork.id, artwork) for artwork in artworks if 'images' in sql_alchemy_inspect(artwork).unloaded)
+        if not pending:
+            return
+
+        images = dict((artwork_id, []) for artwork_id in pending)
+        rows = ArtworkImage.query.filter(ArtworkImage.artwork_id.in_(list(pending))).order_by(ArtworkImage.artwork_id, ArtworkImage.position)
+        for row in rows:
+            images[row.artwork_id].append(row)
+        for artwork_id, artwork in pending.items():
+            set_committed_value(artwork, 'images', images[artwork_id])
+
+    @classmethod
+    def iter_feed_chunks(cls, artworks, chunk_size = None, stream = False, include_gallery = False):
+        """
+        Yield lists of artworks whose artists are loaded, from a query or a list of artworks.
+        With include_gallery the gallery images are loaded in bulk as well.
+        """
+        chunk_size = chunk_size or cls.FEED_CHUNK
+
+        if isinstance(artworks, Query):
+            query = artworks.options(joinedload(cls.artist))
+            if include_gallery:
+                query = query.options(selectinload(cls.images))
+            if not stream:
+                yield query.all()
+                return
+
+            chunk = []
+            for artwork in query.yield_per(chunk_size):
+                chunk.append(artwork)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+            return
+
+        artworks = list(artworks)
+        if not stream:
+            chunk_size = max(len(artworks), 1)
+        for start in range(0, len(artworks), chunk_size):
+            chunk = artworks[start:start + chunk_size]
+            artists = cls.preload_artists(chunk) # held until the chunk is serialized
+            if include_gallery:
+                cls.preload_images(chunk)
+            yield chunk
+
+    @classmethod
+    def serialize_many(cls, artworks, envelope_type = False, stream = False, chunk_size = None, include_gallery = False):
+        """
+        get_json() for a query or a list of artworks, loading every artist with one query instead of one per artwork.
+        With stream = True a generator is returned that works through the rows FEED_CHUNK at a time, for large exports.
+        List views leave the gallery out unless include_gallery is set.
+        """
+        serialized = (artwork.get_json(envelope_type, include_gallery) for chunk in cls.iter_feed_chunks(artworks, chunk_size, stream, include_gallery) for artwork in chunk)
+        if stream:
+            return serialized
+        return list(serialized)
+
+    @classmethod
+    def feed(cls, order = 'sort_order', cursor = None, limit = None, category = None, featured = None, user_id = None, include_hidden = False):
+        """
+        One page of a keyset paginated feed, returns (artworks, next_cursor).
+        Pass next_cursor back in for the following page, it is None on the last one. Every page seeks
+        straight to its position through the (order column, id) indexes, page N costs the same as page 1.
+        """
+        if order not in cls.FEED_ORDERS:
+            raise ValueError("Unknown feed order {}".format(order))
+        limit = limit or cls.FEED_PAGE_SIZE
+
+        query = cls.query
+        if not include_hidden:
+            # Written as the partial feed indexes' predicates, so the planner can use them.
+            query = query.filter(~cls.hidden)
+        if category is not None:
+            query = query.filter(cls.category == category)
+        if featured is not None:
+            query = query.filter(cls.is_featured if featured else ~cls.is_featured)
+        if user_id is not None:
+            query = query.filter(cls.user_id == user_id)
+
+        position = cls.decode_feed_cursor(cursor, order) if cursor else None
+        if order == 'added':
+            if position:
+                query = query.filter(tuple_(cls.added, cls.id) < tuple_(*position))
+            artworks = query.order_by(cls.added.desc(), cls.id.desc()).limit(limit + 1).all()
+        else:
+            # Two phases, each one index seek: the sorted artworks by (sort_order, id), then the unsorted
+            # tail (NULL sort_order) by id. A cursor holding a NULL sort_order points into the tail.
+            sort_order, last_id = position if position else (None, None)
+            artworks = []
+            if not position or sort_order is not None:
+                sorted_query = query.filter(cls.sort_order.isnot(None))
+                if position:
+                    sorted_query = sorted_query.filter(tuple_(cls.sort_order, cls.id) > tuple_(sort_order, last_id))
+                artworks = sorted_query.order_by(cls.sort_order.asc(), cls.id.asc()).limit(limit + 1).all()
+                last_id = None
+            if len(artworks) <= limit:
+                tail_query = query.filter(cls.sort_order.is_(None))
+                if last_id is not None:
+                    tail_query = tail_query.filter(cls.id > last_id)
+                artworks += tail_query.order_by(cls.id.asc()).limit(limit + 1 - len(artworks)).all()
+
+        next_cursor = None
+        if len(artworks) > limit:
+            artworks = artworks[:limit]
+            next_cursor = cls.encode_feed_cursor(artworks[-1], order)
+        return artworks, next_cursor
+
+    @staticmethod
+    def encode_feed_cursor(artwork, order):
+        value = getattr(artwork, order)
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        return base64.urlsafe_b64encode(json.dumps([value, artwork.id]).encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_feed_cursor(cursor, order):
+        try:
+            value, artwork_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except Exception as e:
+            raise ValueError("Invalid feed cursor")
+        if order == 'added' and value is not None:
+            value = parser.isoparse(value)
+        return value, artwork_id
+
+    @classmethod
+    def prepare_ingest_row(cls, record):
+        """
+        Turn one ingestion record into an artwork table row, the same values the setters would produce.
+        Records are dicts with title, main_image and either user_id or artist, plus optional body,
+        keywords, gallery (list), x / y / latest_x / latest_y, model, model_type, model_url,
+        sort_order, category, is_featured and hidden.
+        """
+        for required in ('title', 'main_image'):
+            if not record.get(required):
+                raise ValueError("Missing {}".format(required))
+
+        user_id = record['artist'].id if record.get('artist') is not None else record.get('user_id')
+        if user_id is None:
+            raise ValueError("Missing user_id or artist")
+
+        gallery = record.get('gallery') or []
+        if not isinstance(gallery, list):
+            raise ValueError("gallery must be a list")
+
+        coords = {'x':record.get('x', 0),'y':record.get('y', 0), "latest_x":record.get('latest_x', 0), "latest_y":record.get('latest_y', 0)}
+        x, y, latest_x, latest_y = [float(coords[axis]) for axis in ('x', 'y', 'latest_x', 'latest_y')]
+
+        row = {
+            'user_id': user_id,
+            'title': record['title'],
+            'slug': cls.make_slug(record['title']),
+            'body': record.get('body'),
+            'keywords': cls.clean_keywords(record.get('keywords') or ''),
+            'main_image': record['main_image'],
+            'gallery_images': gallery,
+            'coords': json.dumps(coords),
+            'x': x,
+            'y': y,
+            'latest_x': latest_x,
+            'latest_y': latest_y,
+            'grid_cell': cls.grid_key(*cls.grid_position(x, y)),
+            'model': record.get('model', ''),
+            'model_type': record.get('model_type'),
+            'model_url': record.get('model_url'),
+            'sort_order': record.get('sort_order'),
+            'category': record.get('category'),
+            'is_featured': bool(record.get('is_featured', False)),
+            'hidden': bool(record.get('hidden', False)),
+        }
+        return row
+
+    @classmethod
+    def bulk_ingest(cls, records, chunk_size = 1000):
+        """
+        Insert many artworks with one executemany per chunk, committing chunk by chunk.
+        Slugs, keywords, coords and galleries are built in Python, UIDs are reserved per chunk with
+        reserve_unique_hashes and the keyword index is written in bulk as well. A bad record, or a
+        chunk the database rejects, never aborts the import: rejected chunks are retried record by
+        record inside savepoints. Returns {'ids': [...], 'failures': [(record index, message)]}.
+        """
+        report = {'ids': [], 'failures': []}
+        chunk = []
+        for index, record in enumerate(records):
+            try:
+                chunk.append((index, cls.prepare_ingest_row(record)))
+            except Exception as e:
+                report['failures'].append((index, str(e)))
+
+            if len(chunk) >= chunk_size:
+                cls._ingest_chunk(chunk, report)
+                chunk = []
+
+        if chunk:
+            cls._ingest_chunk(chunk, report)
+        return report
+
+    @classmethod
+    def _ingest_chunk(cls, chunk, report):
+        for (index, row), unique_hash in zip(chunk, cls.reserve_unique_hashes(len(chunk))):
+            row['unique_hash'] = unique_hash
+
+        try:
+            cls._insert_rows([row for index, row in chunk])
+            db.session.commit()
+            inserted = chunk
+        except SQLAlchemyError:
+            db.session.rollback()
+            inserted = []
+            for index, row in chunk:
+                try:
+                    with db.session.begin_nested():
+                        cls._insert_rows([row])
+                    inserted.append((index, row))
+                except SQLAlchemyError as e:
+                    report['failures'].append((index, str(getattr(e, 'orig', e))))
+            db.session.commit()
+
+        ids = dict(db.session.query(cls.unique_hash, cls.id).filter(cls.unique_hash.in_([row['unique_hash'] for index, row in inserted])))
+        report['ids'].extend(ids[row['unique_hash']] for index, row in inserted)
+
+    @classmethod
+    def _insert_rows(cls, rows):
+        db.session.execute(cls.__table__.insert(), [dict((key, value) for key, value in row.items() if key != 'gallery_images') for row in rows])
+
+        # The keyword index and gallery rows need the new ids, fetched back through the reserved UIDs.
+        ids = dict(db.session.query(cls.unique_hash, cls.id).filter(cls.unique_hash.in_([row['unique_hash'] for row in rows])))
+        keyword_rows = []
+        image_rows = []
+        for row in rows:
+            artwork_id = ids[row['unique_hash']]
+            for keyword in cls.normalize_keywords(row['keywords']):
+                keyword_rows.append({'artwork_id': artwork_id, 'keyword': keyword})
+            for position, image in enumerate(row['gallery_images']):
+                image_rows.append({'artwork_id': artwork_id, 'position': position, 'image': image})
+        if keyword_rows:
+            db.session.execute(ArtworkKeyword.__table__.insert(), keyword_rows)
+        if image_rows:
+            db.session.execute(ArtworkImage.__table__.insert(), image_rows)
+
+    def touch(self):
+        """
+        Bump `updated` for changes that only touch related rows, such as the gallery images.
+        It is the json_cache version, so other processes drop their cached entries as well.
+        """
+        self.updated = datetime.datetime.now(datetime.timezone.utc)
+        self.invalidate_json_cache()
 
     def set_gallery(self, gallery):
         if isinstance(gallery, list):
-            self.gallery = json.dumps(gallery)
+            self.images = [ArtworkImage(position = position, image = image) for position, image in enumerate(gallery)]
+            self.gallery = '[]'
+            self.touch()
+
+    def add_gallery_image(self, image):
+        """ Append one image, a single row insert instead of rewriting the whole gallery """
+        position = self.images[-1].position + 1 if self.images else 0
+        self.images.append(ArtworkImage(position = position, image = image))
+        self.touch()
 
+    def remove_gallery_image(self, image):
+        removed = [row for row in self.images if row.image == image]
+        for row in removed:
+            self.images.remove(row)
+        if removed:
+            self.touch()
 
     def get_gallery(self):
-        try:
-            return json.loads(self.gallery)
-        except Exception as e:
-            return []
\ No newline at end of file
+        if self.images:
+            return [row.image for row in self.images]
+        # Rows not migrated yet still hold their gallery as JSON.
+        return list(self.decoded_column('gallery', []))
+
+    @classmethod
+    def load_detail(cls, artwork_id):
+        """ One artwork with its artist and gallery images, fetched in a single query """
+        return cls.query.options(joinedload(cls.artist), joinedload(cls.images)).filter(cls.id == artwork_id).first()
+
+    @classmethod
+    def migrate_gallery_table(cls, chunk_size = 1000):
+        """ Move the legacy JSON galleries into artwork_image rows, chunk by chunk. Safe to run again. """
+        last_id = 0
+        while True:
+            artworks = cls.query.filter(cls.id > last_id).order_by(cls.id).limit(chunk_size).all()
+            if not artworks:
+                break
+            last_id = artworks[-1].id
+
+            # One query for the images of the whole chunk, not one per artwork.
+            cls.preload_images(artworks)
+            image_rows = []
+            for artwork in artworks:
+                legacy_gallery = artwork.decoded_column('gallery', [])
+                if legacy_gallery and not artwork.images:
+                    image_rows.extend({'artwork_id': artwork.id, 'position': position, 'image': image} for position, image in enumerate(legacy_gallery))
+                if artwork.gallery != '[]':
+                    artwork.gallery = '[]'
+                    artwork.invalidate_json_cache()
+            if image_rows:
+                db.session.execute(ArtworkImage.__table__.insert(), image_rows)
+            db.session.commit()
+
+
+class ArtworkKeyword(db.Model):
+    """ One row per (artwork, keyword), the inverted index behind Artwork keyword search """
+
+    __tablename__ = 'artwork_keyword'
+    __table_args__ = (
+        db.Index('ix_artwork_keyword_keyword_artwork', 'keyword', 'artwork_id'),
+    )
+
+    artwork_id = db.Column(db.ForeignKey(u'artwork.id', ondelete = 'CASCADE'), primary_key = True)
+    keyword = db.Column(db.String(255), primary_key = True)
+
+
+class ArtworkImage(db.Model):
+    """ One gallery image of an artwork, in gallery order """
+
+    __tablename__ = 'artwork_image'
+    __table_args__ = (
+        db.Index('ix_artwork_image_artwork_position', 'artwork_id', 'position'),
+    )
+
+    id = db.Column(db.Integer, primary_key = True)
+    artwork_id = db.Column(db.ForeignKey(u'artwork.id', ondelete = 'CASCADE'), nullable = False)
+    position = db.Column(db.Integer, nullable = False, default = 0)
+    image = db.Column(db.String(255), nullable = False)
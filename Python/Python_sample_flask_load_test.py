@@ -0,0 +1,391 @@
+"""
+Concurrent load and soak testing for the Flask shopping cart.
+
+Replays the TestCartFunctionality flow (register, auth, library, game list, cart add / remove) for
+many simulated users at once, either in-process through the Flask test client or against a running
+server. Every request is timed. The report lists throughput, p50 / p95 / p99 latency and the error
+rate per endpoint. Besides server errors, the cart invariants are checked: an add must never list
+a game twice, a remove on an unshared cart must actually drop it, and once the run is over every
+cart, shared ones included, must hold its game exactly once.
+
+    python Python_sample_flask_load_test.py -u 50 -d 300
+    python Python_sample_flask_load_test.py --url http://127.0.0.1:5000 -u 20 -a 5 -d 60
+"""
+
+#!flask/bin/python
+import os
+import sys
+import json
+import time
+import math
+import argparse
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app
+
+from app.tests.base_unittest import BaseUnitTest
+
+# Defaults for the in-process unittest run, overridable through the environment.
+LOAD_USERS = int(os.environ.get('CART_LOAD_USERS', 8))
+LOAD_ACCOUNTS = int(os.environ.get('CART_LOAD_ACCOUNTS', 0))
+LOAD_ITERATIONS = int(os.environ.get('CART_LOAD_ITERATIONS', 5))
+LOAD_DURATION = float(os.environ.get('CART_LOAD_DURATION', 0))
+LOAD_OUTPUT = os.environ.get('CART_LOAD_OUTPUT')
+
+PASSWORD = 'test12345'
+
+
+class InProcessTransport(object):
+    """ Sends requests through a Flask test client, one client per thread """
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._local = threading.local()
+
+    def request(self, method, path, headers, payload = None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        data = json.dumps(payload) if payload is not None else None
+        response = client.open(path, method = method, headers = headers, data = data)
+        return response.status_code, response.data
+
+
+class HttpTransport(object):
+    """ Sends requests to a running server, e.g. http://127.0.0.1:5000 """
+
+    def __init__(self, base_url, timeout = 30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, method, path, headers, payload = None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(self.base_url + path, data = data, headers = headers, method = method)
+        try:
+            with urllib.request.urlopen(request, timeout = self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+
+class EndpointStats(object):
+    __slots__ = ('latencies', 'errors', 'check_failures')
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.check_failures = 0
+
+
+class LoadStats(object):
+    """ Latencies and failures per endpoint, shared by every simulated user """
+
+    def __init__(self):
+        self.endpoints = {}
+        self.failures = []
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = EndpointStats()
+        return stats
+
+    def record(self, endpoint, seconds, error = None):
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats.latencies.append(seconds)
+            if error is not None:
+                stats.errors += 1
+                self.failures.append((endpoint, error))
+
+    def check_failed(self, endpoint, problem):
+        with self._lock:
+            self._endpoint(endpoint).check_failures += 1
+            self.failures.append((endpoint, problem))
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def failure_count(self):
+        return len(self.failures)
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started if self.started is not None else 0.0
+        endpoints = {}
+        for endpoint, stats in self.endpoints.items():
+            latencies = sorted(stats.latencies)
+            count = len(latencies)
+            endpoints[endpoint] = {
+                'requests': count,
+                'throughput': count / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'errors': stats.errors,
+                'check_failures': stats.check_failures,
+                'error_rate': (stats.errors + stats.check_failures) / count if count else 0.0,
+            }
+
+        total = sum(values['requests'] for values in endpoints.values())
+        return {
+            'seconds': elapsed,
+            'requests': total,
+            'throughput': total / elapsed if elapsed else 0.0,
+            'failures': self.failure_count,
+            'endpoints': endpoints,
+        }
+
+    def report(self):
+        summary = self.summary()
+        lines = ['{:<40} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8}'.format(
+            'endpoint', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors', 'error %')]
+        for endpoint, values in sorted(summary['endpoints'].items()):
+            lines.append('{:<40} {:>9} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8} {:>8.2f}'.format(
+                endpoint, values['requests'], values['throughput'], values['p50_ms'], values['p95_ms'],
+                values['p99_ms'], values['errors'] + values['check_failures'], values['error_rate'] * 100))
+        lines.append('{} requests in {:.1f}s, {:.1f} req/s, {} failures'.format(
+            summary['requests'], summary['seconds'], summary['throughput'], summary['failures']))
+        for endpoint, problem in self.failures[:20]:
+            lines.append('  {}: {}'.format(endpoint, problem))
+        return '\n'.join(lines)
+
+
+def percentile(sorted_values, rank):
+    """ Nearest rank percentile of an already sorted list """
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(math.ceil(rank / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class SimulatedUser(object):
+    """ One client walking through the cart flow of TestCartFunctionality.test_cart """
+
+    def __init__(self, transport, stats, email, shared_account = False):
+        self.transport = transport
+        self.stats = stats
+        self.email = email
+        self.shared_account = shared_account
+        self.game_uid = None
+        self.headers = { 'Content-Type':'application/json', 'Accept':'application/json' }
+
+    def call(self, method, path, payload = None):
+        """ Timed request, returns the decoded json response or None when the request failed """
+        started = time.perf_counter()
+        try:
+            status, body = self.transport.request(method, path, self.headers, payload)
+        except Exception as error:
+            self.stats.record(path, time.perf_counter() - started, repr(error))
+            return None
+        seconds = time.perf_counter() - started
+
+        if status >= 500:
+            self.stats.record(path, seconds, 'HTTP {}'.format(status))
+            return None
+        try:
+            response = json.loads(body.decode('utf-8'))
+        except ValueError:
+            self.stats.record(path, seconds, 'HTTP {}, response is not json'.format(status))
+            return None
+        self.stats.record(path, seconds)
+        return response
+
+    def check(self, path, condition, problem):
+        if not condition:
+            self.stats.check_failed(path, '{} ({})'.format(problem, self.email))
+        return condition
+
+    def register(self):
+        pkg = { 'password':PASSWORD, 'verify_password':PASSWORD, 'email':self.email }
+        response = self.call('POST', '/user/register', pkg)
+        return response is not None and self.check('/user/register', 'success' in response, 'registration failed')
+
+    def log_in(self):
+        pkg = { 'username':self.email, 'password':PASSWORD }
+        response = self.call('POST', '/user/auth', pkg)
+        if response is None or not self.check('/user/auth', 'access_token' in response, 'no access token'):
+            return False
+        self.headers['Authorization'] = 'Bearer {}'.format(response['access_token'])
+        return True
+
+    def browse(self):
+        """ Library and game list, returns the games available for purchase """
+        response = self.call('GET', '/user/library')
+        if response is not None and self.check('/user/library', 'success' in response, 'library failed'):
+            if not self.shared_account:
+                self.check('/user/library', response.get('library') == [], 'library of a new user is not empty')
+
+        response = self.call('GET', '/game/list')
+        if response is None or not self.check('/game/list', 'success' in response and response.get('games'), 'no games listed'):
+            return []
+        return response['games']
+
+    def add_invalid(self, hidden_uid = None):
+        """ The invalid add requests of test_cart, every one must be refused """
+        invalid = [[], {'uid':'nonexistent'}]
+        if hidden_uid is not None:
+            invalid.append(hidden_uid)
+        for game_id in invalid:
+            response = self.call('POST', '/store/cart/manage-product/add', {'game_id':game_id})
+            if response is not None:
+                self.check('/store/cart/manage-product/add', 'error' in response, 'invalid game_id {!r} accepted'.format(game_id))
+
+    def cart_items(self, path, response):
+        if response is None or not self.check(path, 'success' in response and 'items' in response.get('cart', {}), 'no cart in response'):
+            return None
+        items = response['cart']['items']
+        self.check(path, len(items) == len(set(items)), 'cart lists a game twice: {}'.format(items))
+        return items
+
+    def cart_cycle(self, game_uid):
+        """ Add, add again, remove and add back one game, checking the cart after every step """
+        pkg = {'game_id':game_uid}
+        add_path = '/store/cart/manage-product/add'
+        remove_path = '/store/cart/manage-product/remove'
+
+        # On a shared account other users add and remove the same game in between, only the
+        # duplicate check in cart_items holds there.
+        for attempt in range(2):
+            items = self.cart_items(add_path, self.call('POST', add_path, pkg))
+            if items is not None and not self.shared_account:
+                self.check(add_path, game_uid in items, 'added game missing from cart')
+                self.check(add_path, len(items) == 1, 'expected one item, cart holds {}'.format(len(items)))
+
+        items = self.cart_items(remove_path, self.call('POST', remove_path, pkg))
+        if items is not None and not self.shared_account:
+            self.check(remove_path, game_uid not in items, 'removed game still in cart')
+
+        items = self.cart_items(add_path, self.call('POST', add_path, pkg))
+        if items is not None and not self.shared_account:
+            self.check(add_path, game_uid in items, 'game missing from cart after adding it back')
+
+    def verify_cart(self, game_uid):
+        """
+        Once every user is done: all cycles end with an add, so the account's cart must hold its game exactly once.
+        The cart is read back through one more add of the same game, which test_cart shows leaves the cart as it is.
+        """
+        path = '/store/cart/manage-product/add'
+        if not self.log_in():
+            return
+        items = self.cart_items(path, self.call('POST', path, {'game_id':game_uid}))
+        if items is not None:
+            self.check(path, list(items).count(game_uid) == 1 and len(items) == 1,
+                'after the run the cart should hold {} once, it holds {}'.format(game_uid, list(items)))
+
+    def run(self, user_index, hidden_uid = None, iterations = 1, deadline = None):
+        if not self.log_in():
+            return
+        games = self.browse()
+        if not games:
+            return
+        self.add_invalid(hidden_uid)
+
+        # Users of the same account work on the same game, so their adds and removes collide.
+        game_uid = self.game_uid = games[user_index % len(games)]['uid']
+        cycle = 0
+        while (deadline is None and cycle < iterations) or (deadline is not None and time.perf_counter() < deadline):
+            self.cart_cycle(game_uid)
+            cycle += 1
+
+
+def run_load(transport, users, accounts = 0, iterations = 1, duration = 0, hidden_uid = None, email_prefix = None):
+    """
+    Drive users concurrent simulated users through the cart flow and return the LoadStats.
+    accounts < users makes several users share one account (and cart) to test the cart under contention,
+    0 gives every user its own account. With a duration in seconds every user keeps cycling its cart
+    until the time is up (soak mode), otherwise it runs iterations cart cycles.
+    """
+    accounts = accounts if 0 < accounts < users else users
+    email_prefix = email_prefix or 'load{}'.format(int(time.time() * 1000))
+    emails = ['{}-{}@phyffer.com'.format(email_prefix, index) for index in range(accounts)]
+    # Register every account before the concurrent phase, so users of a shared account can log in.
+    # Registration is kept out of the measurements, only its failures are carried over.
+    setup = LoadStats()
+    for email in emails:
+        SimulatedUser(transport, setup, email).register()
+
+    stats = LoadStats()
+    stats.failures.extend(setup.failures)
+    stats.start()
+    deadline = time.perf_counter() + duration if duration else None
+    simulated = [SimulatedUser(transport, stats, emails[index % accounts], shared_account = accounts < users) for index in range(users)]
+    with ThreadPoolExecutor(max_workers = users) as executor:
+        futures = [executor.submit(user.run, index % accounts, hidden_uid, iterations, deadline) for index, user in enumerate(simulated)]
+        for future in futures:
+            future.result()
+    stats.finish()
+
+    # Races between the adds and removes of a shared cart only show once the pool has drained.
+    # Kept out of the measurements like the registration, only its failures are carried over.
+    verification = LoadStats()
+    verified = set()
+    for user in simulated:
+        if user.game_uid is not None and user.email not in verified:
+            verified.add(user.email)
+            SimulatedUser(transport, verification, user.email).verify_cart(user.game_uid)
+    stats.failures.extend(verification.failures)
+    return stats
+
+
+class TestCartLoad(BaseUnitTest):
+    """
+    Cart Load Testing, sized through the CART_LOAD_* environment variables
+    """
+
+    users = LOAD_USERS
+    accounts = LOAD_ACCOUNTS
+    iterations = LOAD_ITERATIONS
+    duration = LOAD_DURATION
+    output_path = LOAD_OUTPUT
+
+    def test_cart_load(self):
+        self.create_sample_games()
+
+        stats = run_load(InProcessTransport(app), self.users, self.accounts, self.iterations, self.duration, self.hidden_game['uid'])
+        print(stats.report())
+        if self.output_path:
+            with open(self.output_path, 'w') as output:
+                json.dump(stats.summary(), output, indent = 2)
+
+        self.assertEqual(stats.failure_count, 0, 'cart failures under load, see the report above')
+
+
+def main(argv = None):
+    arg_parser = argparse.ArgumentParser(description = "Load and soak test the cart endpoints with concurrent simulated users.")
+    arg_parser.add_argument('--url', default = None, help = 'Run against this server instead of in-process, it must already list games')
+    arg_parser.add_argument('-u', '--users', type = int, default = LOAD_USERS, help = 'Concurrent simulated users')
+    arg_parser.add_argument('-a', '--accounts', type = int, default = LOAD_ACCOUNTS, help = 'Accounts shared by the users, 0 for one account per user')
+    arg_parser.add_argument('-i', '--iterations', type = int, default = LOAD_ITERATIONS, help = 'Cart cycles per user')
+    arg_parser.add_argument('-d', '--duration', type = float, default = LOAD_DURATION, help = 'Keep cycling for this many seconds instead (soak mode)')
+    arg_parser.add_argument('--hidden-game', default = None, help = 'Uid of a hidden game that must be refused, for --url runs')
+    arg_parser.add_argument('-o', '--output', default = LOAD_OUTPUT, help = 'Write the summary json to this file')
+    args = arg_parser.parse_args(argv)
+
+    if args.url is None:
+        # In-process runs go through TestCartLoad, which sets up and tears down the test database.
+        TestCartLoad.users, TestCartLoad.accounts, TestCartLoad.iterations = args.users, args.accounts, args.iterations
+        TestCartLoad.duration, TestCartLoad.output_path = args.duration, args.output
+        result = unittest.TextTestRunner(verbosity = 2).run(unittest.TestLoader().loadTestsFromTestCase(TestCartLoad))
+        return 0 if result.wasSuccessful() else 1
+
+    stats = run_load(HttpTransport(args.url), args.users, args.accounts, args.iterations, args.duration, args.hidden_game)
+    print(stats.report())
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(stats.summary(), output, indent = 2)
+    return 0 if not stats.failures else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# benchmark.py
+# Measures how the node pipeline scales. Generates deterministic synthetic datasets in the
+# json-per-node layout, runs test_run.process_dataset on them with the given worker settings and
+# records the time of each instrumented stage as json, so two runs can be compared.
+
+import os, sys, json, random, shutil, tempfile, platform, argparse
+from array import array
+
+import instrumentation
+import test_run
+
+# The instrumentation stages of test_run.process_dataset. discover, parse and validate run inside
+# load, order and translate inside assemble. parse, validate, order and translate are summed over
+# the pool workers, so they can add up to more than the wall time of their enclosing stage.
+STAGES = ['discover', 'parse', 'validate', 'load', 'group', 'order', 'translate', 'assemble', 'write']
+
+# The top level wall time stages, which add up to the total.
+TOTAL_STAGES = ['load', 'group', 'assemble', 'write']
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# Files are spread over sub directories so no single directory grows too large.
+FILES_PER_DIRECTORY = 1000
+
+ESCAPES = ['\\u00e9', '\\u263a', '\\x41', '\\u00fc', '\\t', '\\\\']
+
+def make_payload(generator, escape_ratio):
+    """ A word payload, escape_ratio of them hold hex escapes the translate stage has to decode """
+
+    letters = ''.join(generator.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(generator.randint(1, 8)))
+    if generator.random() < escape_ratio:
+        return letters + ''.join(generator.choice(ESCAPES) for _ in range(generator.randint(1, 4)))
+    return letters
+
+def write_node(dataset_folder, file_index, node):
+    directory = os.path.join(dataset_folder, "{:05d}".format(file_index // FILES_PER_DIRECTORY))
+    with open(os.path.join(directory, "{:08d}.json".format(file_index)), 'w') as node_file:
+        json.dump(node, node_file)
+
+def generate_dataset(dataset_folder, node_count, chain_length=20, escape_ratio=0.5, seed=0):
+    """ Write a synthetic dataset of roughly node_count nodes: sentences of chain_length words,
+    every sentence and word chained to its precedent, written in a shuffled file order.
+    Nodes are written as they are generated, only a shuffled array of file indices is kept in memory.
+    The same arguments always produce the same dataset. Returns the number of nodes written. """
+
+    generator = random.Random(seed)
+    sentence_count = max(1, node_count // (chain_length + 1))
+    total_count = sentence_count * (chain_length + 1)
+
+    # The n-th generated node goes to file_indices[n].
+    file_indices = array('q', range(total_count))
+    generator.shuffle(file_indices)
+    for directory_index in range((total_count + FILES_PER_DIRECTORY - 1) // FILES_PER_DIRECTORY):
+        os.makedirs(os.path.join(dataset_folder, "{:05d}".format(directory_index)), exist_ok=True)
+
+    node_index = 0
+    for sentence_index in range(sentence_count):
+        sentence_id = sentence_index
+        write_node(dataset_folder, file_indices[node_index], {
+            "type": "sentence",
+            "id": sentence_id,
+            "parent_id": None,
+            "precedent": sentence_id - 1 if sentence_index else None,
+        })
+        node_index += 1
+        for word_index in range(chain_length):
+            word_id = sentence_count + sentence_index * chain_length + word_index
+            write_node(dataset_folder, file_indices[node_index], {
+                "type": "word",
+                "id": word_id,
+                "parent_id": sentence_id,
+                "precedent": word_id - 1 if word_index else None,
+                "payload": make_payload(generator, escape_ratio),
+            })
+            node_index += 1
+
+    return total_count
+
+def run_stages(dataset_folder, loader_workers=1, loader_use_processes=False, assembly_workers=1):
+    """ Run the pipeline on one dataset with instrumentation on, returns {stage: seconds} """
+
+    instrumentation.reset()
+    instrumentation.enable(wrap_methods=False)
+    try:
+        test_run.process_dataset(dataset_folder, os.devnull, loader_workers, loader_use_processes, assembly_workers)
+        stages = instrumentation.snapshot()["stages"]
+    finally:
+        instrumentation.disable()
+        instrumentation.reset()
+
+    return dict((stage, stages[stage]["seconds"]) for stage in STAGES if stage in stages)
+
+def run_benchmarks(sizes, chain_length=20, escape_ratio=0.5, seed=0, repeat=1, work_folder=None,
+                   loader_workers=1, loader_use_processes=False, assembly_workers=1):
+    """ Generate and time a dataset for every size, returns the results dictionary """
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "loader_workers": loader_workers,
+        "loader_use_processes": loader_use_processes,
+        "assembly_workers": assembly_workers,
+        "chain_length": chain_length,
+        "escape_ratio": escape_ratio,
+        "seed": seed,
+        "runs": [],
+    }
+
+    for size in sizes:
+        dataset_folder = tempfile.mkdtemp(prefix='nodes_{}_'.format(size), dir=work_folder)
+        try:
+            node_count = generate_dataset(dataset_folder, size, chain_length, escape_ratio, seed)
+            best = {}
+            for _ in range(repeat):
+                for stage, seconds in run_stages(dataset_folder, loader_workers, loader_use_processes, assembly_workers).items():
+                    best[stage] = min(seconds, best.get(stage, seconds))
+        finally:
+            shutil.rmtree(dataset_folder, ignore_errors=True)
+
+        total = sum(best.get(stage, 0.0) for stage in TOTAL_STAGES)
+        results["runs"].append({"size": size, "nodes": node_count, "stages": best, "total": total})
+        print_run(results["runs"][-1])
+
+    return results
+
+def print_run(run):
+    columns = ' '.join("{}={:.3f}s".format(stage, run["stages"][stage]) for stage in STAGES if stage in run["stages"])
+    print("{:>10} nodes  total={:.3f}s  {}".format(run["nodes"], run["total"], columns))
+
+def compare_results(baseline, current):
+    """ Print the per stage time ratio of current against baseline, for every size both ran.
+    Returns the list of (size, stage, ratio) entries. """
+
+    baseline_runs = {run["size"]: run for run in baseline["runs"]}
+    comparison = []
+    for run in current["runs"]:
+        baseline_run = baseline_runs.get(run["size"])
+        if baseline_run is None:
+            continue
+        for stage in STAGES + ['total']:
+            before = baseline_run["total"] if stage == 'total' else baseline_run["stages"].get(stage)
+            after = run["total"] if stage == 'total' else run["stages"].get(stage)
+            if before and after is not None:
+                comparison.append((run["size"], stage, after / before))
+                print("{:>10} {:<10} {:.3f}s -> {:.3f}s  x{:.2f}".format(run["size"], stage, before, after, after / before))
+    return comparison
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Benchmark the node pipeline on synthetic datasets.")
+    arg_parser.add_argument('-s', '--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Dataset sizes in nodes, 1000 up to 10000000')
+    arg_parser.add_argument('-c', '--chain-length', type=int, default=20, help='Words per sentence')
+    arg_parser.add_argument('-e', '--escape-ratio', type=float, default=0.5, help='Share of payloads holding hex escapes')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('-r', '--repeat', type=int, default=1, help='Runs per size, the best time of each stage is kept')
+    arg_parser.add_argument('-w', '--work-folder', default=None, help='Where the datasets are generated, defaults to the temp directory')
+    arg_parser.add_argument('--loader-workers', type=int, default=test_run.LOADER_WORKERS, help='Loader pool size, defaults to one per core')
+    arg_parser.add_argument('--loader-threads', action='store_true', help='Load with threads instead of processes')
+    arg_parser.add_argument('--assembly-workers', type=int, default=test_run.ASSEMBLY_WORKERS, help='Sentence ordering pool size, defaults to one per core')
+    arg_parser.add_argument('-o', '--output', default=None, help='Write the results json to this file')
+    arg_parser.add_argument('--compare', default=None, help='Results json of an earlier run to compare against')
+    args = arg_parser.parse_args(argv)
+
+    loader_use_processes = test_run.LOADER_USE_PROCESSES and not args.loader_threads
+    results = run_benchmarks(args.sizes, args.chain_length, args.escape_ratio, args.seed, args.repeat, args.work_folder,
+                             args.loader_workers, loader_use_processes, args.assembly_workers)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print("Results written to {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline:
+            compare_results(json.load(baseline), results)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
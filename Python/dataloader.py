@@ -0,0 +1,278 @@
+# dataloader.py
+# Reads the data files of a dataset and turns them into Word and Sentence objects.
+# A dataset is either a directory holding one json file per node, or a packed JSON Lines file
+# holding one node per line. Either is read and parsed across a thread or process pool, in batches.
+# With columnar loading the words go into a WordStore instead of one Word object each.
+
+import os, json, mmap, time, argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import utilities
+import instrumentation
+from nodeobjects import Word, Sentence, WordStore, StoredSentence
+
+# Used to determine whether the json data structure is valid, has all of our required keys.
+REQUIRED_FIELDS = ['parent_id', 'id', 'precedent', 'type']
+
+# Extra keys required by each node type, on top of the REQUIRED_FIELDS.
+TYPE_REQUIRED_FIELDS = {
+    'word': ['payload'],
+}
+
+validate_record = utilities.compile_validator(REQUIRED_FIELDS, TYPE_REQUIRED_FIELDS)
+
+DEFAULT_BATCH_SIZE = 256
+
+# Packed datasets are single JSON Lines files, split into byte ranges of roughly this size for the pool.
+PACKED_EXTENSION = '.jsonl'
+PACKED_CHUNK_BYTES = 1 << 20
+
+def is_packed_dataset(dataset_path):
+    return os.path.isfile(dataset_path) and dataset_path.endswith(PACKED_EXTENSION)
+
+def find_data_files(dataset_folder):
+    """ Gather every data file path in the dataset folder, in walk order """
+
+    file_paths = []
+    for root, dirs, files in os.walk(dataset_folder, topdown=True, onerror=None, followlinks=False):
+        for name in files:
+            file_paths.append(os.path.join(root, name))
+    return file_paths
+
+def read_data_file(file_path):
+    """ Load one data file and make sure it holds a valid json data structure """
+
+    with open(file_path, 'r') as json_output:
+        try:
+            data = json.load(json_output)
+        except ValueError:
+            raise utilities.DataValidationError([(file_path, "format")])
+
+    return validate_data(data, file_path)
+
+def validate_data(data, source):
+    problems = validate_record(data)
+    if problems:
+        raise utilities.DataValidationError((source, problem) for problem in problems)
+    return data
+
+# Stands in for the data of a text that is not valid json, between the parse and validate passes.
+_UNPARSED = object()
+
+def parse_records(sources, texts):
+    """ Parse and validate a batch of json texts, returns (records, failures, parse_seconds, validate_seconds).
+    records holds the valid data dictionaries, failures every (source, problem) found in source order.
+    Parsing and validation run as separate passes so each can be timed on its own. """
+
+    started = time.perf_counter()
+    datas = []
+    for text in texts:
+        try:
+            datas.append(json.loads(text))
+        except ValueError:
+            datas.append(_UNPARSED)
+    parsed_at = time.perf_counter()
+
+    records = []
+    failures = []
+    for source, data in zip(sources, datas):
+        if data is _UNPARSED:
+            failures.append((source, "format"))
+            continue
+
+        problems = validate_record(data)
+        if problems:
+            failures.extend((source, problem) for problem in problems)
+        else:
+            records.append(data)
+    return records, failures, parsed_at - started, time.perf_counter() - parsed_at
+
+def pack_dataset(dataset_folder, packed_path):
+    """ Convert a dataset directory into a packed JSON Lines file, one validated node per line.
+    Returns the number of nodes written. """
+
+    node_count = 0
+    with open(packed_path, 'w') as packed:
+        for file_path in find_data_files(dataset_folder):
+            packed.write(json.dumps(read_data_file(file_path)) + '\n')
+            node_count += 1
+    return node_count
+
+def find_packed_ranges(packed_path, chunk_bytes=PACKED_CHUNK_BYTES):
+    """ Split a packed dataset into (start, end) byte ranges that begin and end on line boundaries """
+
+    size = os.path.getsize(packed_path)
+    if not size:
+        return []
+
+    ranges = []
+    with open(packed_path, 'rb') as packed, mmap.mmap(packed.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        start = 0
+        while start < size:
+            end = mapped.find(b'\n', min(start + chunk_bytes, size) - 1)
+            end = size if end < 0 else end + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def iter_packed_lines(packed_path, start=0, end=None):
+    """ Yield (source, line) for every line of a packed dataset byte range, through a memory map.
+    The source names the file and the byte offset of the line. """
+
+    if not os.path.getsize(packed_path):
+        return
+
+    with open(packed_path, 'rb') as packed, mmap.mmap(packed.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        end = len(mapped) if end is None else end
+        position = start
+        while position < end:
+            line_end = mapped.find(b'\n', position, end)
+            line_end = end if line_end < 0 else line_end
+            line = mapped[position:line_end]
+            source = "{}@{}".format(packed_path, position)
+            position = line_end + 1
+            if line.strip():
+                yield source, line
+
+def make_node(data):
+    """ Build the Word or Sentence described by a data dictionary, None for any other type """
+
+    if data['type'] == 'word':
+        return Word(data['parent_id'], data['id'], data['payload'], data['precedent'])
+    elif data['type'] == 'sentence':
+        return Sentence(data['id'], data['precedent'])
+    return None
+
+def make_nodes(datas):
+    """ Build the nodes for a sequence of data dictionaries, returns a (words, sentences) tuple """
+
+    words = []
+    sentences = []
+    for data in datas:
+        node = make_node(data)
+        if isinstance(node, Word):
+            words.append(node)
+        elif isinstance(node, Sentence):
+            sentences.append(node)
+    return words, sentences
+
+def make_columns(datas):
+    """ Like make_nodes, but returns a (WordStore, StoredSentences) tuple. The sentences are handed
+    their store once the batches are merged. """
+
+    store = WordStore()
+    sentences = []
+    for data in datas:
+        if data['type'] == 'word':
+            store.append(data['parent_id'], data['id'], data['payload'], data['precedent'])
+        elif data['type'] == 'sentence':
+            sentences.append(StoredSentence(data['id'], data['precedent']))
+    return store, sentences
+
+def _load_records(sources, texts, columnar):
+    """ Parse, validate and build the nodes of one batch. timings is (parse_seconds, validate_seconds,
+    record_count), the parent records them since the pool workers cannot. """
+
+    records, failures, parse_seconds, validate_seconds = parse_records(sources, texts)
+    words, sentences = (make_columns if columnar else make_nodes)(records)
+    return words, sentences, failures, (parse_seconds, validate_seconds, len(texts))
+
+def load_batch(file_paths, columnar=False):
+    """ Read a batch of data files, returns a (words, sentences, failures, timings) tuple, see _load_records.
+    Runs inside the pool workers. """
+
+    texts = []
+    for file_path in file_paths:
+        with open(file_path, 'rb') as json_output:
+            texts.append(json_output.read())
+
+    return _load_records(file_paths, texts, columnar)
+
+def load_packed_range(packed_path, start, end, columnar=False):
+    """ Read one byte range of a packed dataset, returns a (words, sentences, failures, timings) tuple,
+    see _load_records. Runs inside the pool workers. """
+
+    lines = list(iter_packed_lines(packed_path, start, end))
+    return _load_records([source for source, line in lines], [line for source, line in lines], columnar)
+
+def iter_batches(dataset_path, workers=None, use_processes=False, batch_size=DEFAULT_BATCH_SIZE, failures=None, columnar=False):
+    """ Yield (words, sentences) batches for a dataset directory or packed dataset file, in file order.
+    With columnar the words of each batch come as a WordStore, see make_columns.
+
+    Threads only overlap the file reads, json parsing holds the GIL. Use processes to spread the
+    parsing across cores; callers must then run under an `if __name__ == '__main__':` guard.
+    Invalid records are left out of the batches. They are appended to the failures list when one is
+    given, otherwise the first batch holding any raises a DataValidationError listing them all.
+    The parse and validate seconds of every batch are recorded as the 'parse' and 'validate' stages. """
+
+    if is_packed_dataset(dataset_path):
+        ranges = find_packed_ranges(dataset_path)
+        load_function = load_packed_range
+        arguments = ([dataset_path] * len(ranges), [start for start, end in ranges], [end for start, end in ranges])
+    else:
+        with instrumentation.stage('discover') as discover_stage:
+            file_paths = find_data_files(dataset_path)
+            discover_stage.add_nodes(len(file_paths))
+        load_function = load_batch
+        arguments = ([file_paths[i:i + batch_size] for i in range(0, len(file_paths), batch_size)],)
+
+    batch_count = len(arguments[0])
+    if not batch_count:
+        return
+    arguments += ([columnar] * batch_count,)
+
+    if workers == 1 or batch_count == 1:
+        results = (load_function(*batch_arguments) for batch_arguments in zip(*arguments))
+        for words, sentences, batch_failures, timings in results:
+            _record_timings(timings)
+            _record_failures(batch_failures, failures)
+            yield words, sentences
+        return
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        for words, sentences, batch_failures, timings in executor.map(load_function, *arguments):
+            _record_timings(timings)
+            _record_failures(batch_failures, failures)
+            yield words, sentences
+
+def _record_timings(timings):
+    parse_seconds, validate_seconds, record_count = timings
+    instrumentation.record('parse', parse_seconds, record_count)
+    instrumentation.record('validate', validate_seconds, record_count)
+
+def _record_failures(batch_failures, failures):
+    if not batch_failures:
+        return
+    if failures is None:
+        raise utilities.DataValidationError(batch_failures)
+    failures.extend(batch_failures)
+
+def load_dataset(dataset_path, workers=None, use_processes=False, batch_size=DEFAULT_BATCH_SIZE, columnar=False):
+    """ Load a whole dataset directory or packed dataset file, returns a (words, sentences) tuple.
+    With columnar words is a single WordStore and the sentences are StoredSentences using it.
+    Every record is validated, a DataValidationError reports all the invalid ones at once. """
+
+    words = WordStore() if columnar else []
+    sentences = []
+    failures = []
+    for batch_words, batch_sentences in iter_batches(dataset_path, workers, use_processes, batch_size, failures, columnar):
+        words.extend(batch_words)
+        sentences.extend(batch_sentences)
+
+    if columnar:
+        for sentence in sentences:
+            sentence.store = words
+
+    if failures:
+        raise utilities.DataValidationError(failures)
+    return words, sentences
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Pack a dataset directory into a single JSON Lines file.")
+    arg_parser.add_argument('dataset_folder', help='Dataset directory holding one json file per node')
+    arg_parser.add_argument('packed_path', nargs='?', help='Output file, defaults to the directory name + {}'.format(PACKED_EXTENSION))
+    args = arg_parser.parse_args()
+
+    packed_path = args.packed_path or os.path.normpath(args.dataset_folder) + PACKED_EXTENSION
+    print("Packed {} nodes into {}".format(pack_dataset(args.dataset_folder, packed_path), packed_path))
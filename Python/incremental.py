@@ -0,0 +1,188 @@
+# incremental.py
+# Keeps an assembled dataset directory in memory and re-assembles only what changed.
+# Added, changed or removed data files are re-parsed on their own, and only the sentences whose
+# words changed get their precedent chains re-linked and re-ordered.
+
+import os, time, argparse
+
+import dataloader
+import utilities
+from nodeobjects import Word, Sentence, Paragraph
+
+class IncrementalAssembler:
+    def __init__(self, dataset_folder):
+        self.dataset_folder = dataset_folder
+        self.paragraph = Paragraph()
+
+        # file path -> (mtime_ns, size) of the parsed version, and the node it produced
+        self.file_stamps = {}
+        self.nodes = {}
+
+        # file path -> (mtime_ns, size) of a version that failed to parse, retried once it changes again
+        self.failed_stamps = {}
+
+        # file path -> Sentence, and sentence id -> {file path: Word}
+        self.sentences = {}
+        self.words_by_parent = {}
+
+    def refresh(self):
+        """ Stat the dataset directory and apply whatever was added, changed or removed since the
+        last refresh. Returns True when the paragraph changed. """
+
+        stamps = {}
+        for file_path in dataloader.find_data_files(self.dataset_folder):
+            # Editors and atomic writers delete or rename files between the listing and the stat.
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            stamps[file_path] = (stat.st_mtime_ns, stat.st_size)
+
+        for file_path in list(self.failed_stamps):
+            if file_path not in stamps:
+                del self.failed_stamps[file_path]
+
+        changed_paths = [path for path, stamp in stamps.items() if self.file_stamps.get(path) != stamp and self.failed_stamps.get(path) != stamp]
+        removed_paths = [path for path in self.file_stamps if path not in stamps]
+        return self.apply_changes(changed_paths, removed_paths, stamps)
+
+    def apply_changes(self, changed_paths=(), removed_paths=(), stamps=None):
+        """ Re-parse the changed (or added) files, drop the removed ones and re-order the affected
+        sentences. Use this directly when a file watcher already knows what changed, it skips the
+        directory scan. Returns True when the paragraph changed.
+
+        Changed files that are gone by the time they are read count as removed. Files that fail to
+        parse or read, e.g. while they are still being written, keep their previous node and are
+        retried once they change again. Everything else is applied, then a DataValidationError lists
+        the failed files. """
+
+        parsed = []
+        failures = []
+        removed_paths = list(removed_paths)
+        for file_path in changed_paths:
+            stamp = stamps.get(file_path) if stamps is not None else None
+            try:
+                if stamp is None:
+                    stat = os.stat(file_path)
+                    stamp = (stat.st_mtime_ns, stat.st_size)
+                parsed.append((file_path, stamp, dataloader.make_node(dataloader.read_data_file(file_path))))
+            except FileNotFoundError:
+                removed_paths.append(file_path)
+            except utilities.DataValidationError as error:
+                self.failed_stamps[file_path] = stamp
+                failures.extend(error.failures)
+            except OSError as error:
+                self.failed_stamps[file_path] = stamp
+                failures.append((file_path, "file: {}".format(error.strerror or error)))
+
+        affected_parents = set()
+        sentences_changed = False
+
+        for file_path in removed_paths:
+            node = self._forget(file_path)
+            if isinstance(node, Word):
+                affected_parents.add(node.parent_id)
+            elif isinstance(node, Sentence):
+                affected_parents.add(node.id)
+                sentences_changed = True
+
+        for file_path, stamp, node in parsed:
+            old_node = self._forget(file_path)
+            self.failed_stamps.pop(file_path, None)
+            self.file_stamps[file_path] = stamp
+            self.nodes[file_path] = node
+
+            for touched in (old_node, node):
+                if isinstance(touched, Word):
+                    affected_parents.add(touched.parent_id)
+                elif isinstance(touched, Sentence):
+                    affected_parents.add(touched.id)
+                    sentences_changed = True
+
+            if isinstance(node, Word):
+                self.words_by_parent.setdefault(node.parent_id, {})[file_path] = node
+            elif isinstance(node, Sentence):
+                self.sentences[file_path] = node
+
+        for sentence in self.sentences.values():
+            if sentence.id in affected_parents:
+                self._order_sentence(sentence)
+
+        if sentences_changed:
+            self._order_paragraph()
+
+        if failures:
+            raise utilities.DataValidationError(failures)
+        return bool(affected_parents)
+
+    def _forget(self, file_path):
+        """ Drop everything known about a file, returns the node it produced """
+
+        self.file_stamps.pop(file_path, None)
+        self.failed_stamps.pop(file_path, None)
+        node = self.nodes.pop(file_path, None)
+        if isinstance(node, Word):
+            group = self.words_by_parent.get(node.parent_id)
+            if group is not None:
+                group.pop(file_path, None)
+                if not group:
+                    del self.words_by_parent[node.parent_id]
+        elif isinstance(node, Sentence):
+            self.sentences.pop(file_path, None)
+        return node
+
+    def _order_sentence(self, sentence):
+        words = list(self.words_by_parent.get(sentence.id, {}).values())
+
+        # Links left over from the previous ordering may point at words that are gone.
+        for word in words:
+            if word.precedent is not None:
+                word.set_precedent(None)
+
+        sentence.words = []
+        for word in words:
+            sentence.add_word(word)
+        sentence.map_precedents_and_order()
+
+    def _order_paragraph(self):
+        sentences = list(self.sentences.values())
+        for sentence in sentences:
+            if sentence.precedent is not None:
+                sentence.set_precedent(None)
+
+        self.paragraph.sentences = sentences
+        self.paragraph.map_precedents_and_order()
+
+    def write_output(self, output_path):
+        with open(output_path, "w") as f:
+            self.paragraph.write_formatted_payload(f)
+
+def watch(dataset_folder, output_path, interval=1.0):
+    """ Assemble the dataset folder, then keep re-assembling it incrementally and rewriting the
+    output whenever a data file changes. Invalid data files are reported and skipped until they
+    change again. """
+
+    assembler = IncrementalAssembler(dataset_folder)
+    while True:
+        started = time.time()
+        try:
+            changed = assembler.refresh()
+        except utilities.DataValidationError as error:
+            print("Skipped until they change again: {}".format(error))
+            changed = True
+        if changed:
+            assembler.write_output(output_path)
+            print("Payload written to {} ({:.1f} ms)".format(output_path, (time.time() - started) * 1000))
+        time.sleep(interval)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Watch a dataset directory and rewrite its output whenever a data file changes.")
+    arg_parser.add_argument('dataset_folder', help='Dataset directory holding one json file per node')
+    arg_parser.add_argument('output_path', help='File the paragraph payload is written to')
+    arg_parser.add_argument('-i', '--interval', type=float, default=1.0, help='Seconds between directory scans')
+    args = arg_parser.parse_args()
+
+    try:
+        watch(args.dataset_folder, args.output_path, args.interval)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,216 @@
+# instrumentation.py
+# Optional timing and memory instrumentation for the node pipeline.
+# Everything is off by default. While off, stage() hands back a shared do-nothing context manager
+# and the nodeobjects classes are left untouched, so there is nothing to pay for. enable() wraps the
+# nodeobjects methods the pipeline calls and starts recording wall time, call counts, node counts
+# and, optionally, peak traced memory per stage. Stages are recorded from the main thread only.
+# Wrapped methods only see calls made in this process. Work done in pool workers, such as the
+# sharded ordering and translation, is timed there and added with record() under its own stage.
+
+import os, json, time, threading, functools, tracemalloc
+
+import nodeobjects
+
+ENABLED = False
+TRACE_MEMORY = False
+
+# Chrome trace events kept per process, per word stages would otherwise grow without bound.
+MAX_TRACE_EVENTS = 100000
+
+_stats = {}
+_events = []
+_memory_peaks = []
+_originals = {}
+_epoch = time.perf_counter()
+
+class StageStats:
+    __slots__ = ('name', 'calls', 'nodes', 'seconds', 'peak_bytes')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.nodes = 0
+        self.seconds = 0.0
+        self.peak_bytes = 0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "nodes": self.nodes,
+            "seconds": self.seconds,
+            "peak_bytes": self.peak_bytes,
+        }
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add_nodes(self, count):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    __slots__ = ('name', 'nodes', 'started')
+
+    def __init__(self, name, nodes=0):
+        self.name = name
+        self.nodes = nodes
+
+    def add_nodes(self, count):
+        self.nodes += count
+
+    def __enter__(self):
+        if TRACE_MEMORY:
+            # Hand the peak so far to the enclosing stage, then measure this stage on its own.
+            current, peak = tracemalloc.get_traced_memory()
+            if _memory_peaks:
+                _memory_peaks[-1] = max(_memory_peaks[-1], peak)
+            _memory_peaks.append(current)
+            tracemalloc.reset_peak()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started
+        peak = 0
+        if TRACE_MEMORY and _memory_peaks:
+            peak = max(_memory_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if _memory_peaks:
+                _memory_peaks[-1] = max(_memory_peaks[-1], peak)
+        _record(self.name, seconds, self.nodes, peak, self.started)
+        return False
+
+def _record(name, seconds, nodes, peak_bytes, started):
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = StageStats(name)
+    stats.calls += 1
+    stats.nodes += nodes
+    stats.seconds += seconds
+    stats.peak_bytes = max(stats.peak_bytes, peak_bytes)
+
+    if started is not None and len(_events) < MAX_TRACE_EVENTS:
+        _events.append({
+            "name": name,
+            "ph": "X",
+            "ts": (started - _epoch) * 1e6,
+            "dur": seconds * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {"nodes": nodes},
+        })
+
+def stage(name, nodes=0):
+    """ Context manager timing one pipeline stage, free when instrumentation is off """
+
+    if not ENABLED:
+        return _NULL_STAGE
+    return _Stage(name, nodes)
+
+def record(name, seconds, nodes=0):
+    """ Add time measured elsewhere, e.g. summed up in a pool worker, to a stage. No trace event is
+    kept since the start time belongs to another process. """
+
+    if ENABLED:
+        _record(name, seconds, nodes, 0, None)
+
+def _wrap(owner, attribute, count_nodes):
+    original = owner.__dict__[attribute]
+    _originals[(owner, attribute)] = original
+    name = "{}.{}".format(owner.__name__, attribute)
+    function = original.fget if isinstance(original, property) else original
+
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        with _Stage(name, count_nodes(self)):
+            return function(self, *args, **kwargs)
+
+    setattr(owner, attribute, property(wrapper, original.fset, original.fdel) if isinstance(original, property) else wrapper)
+
+def enable(trace_memory=False, wrap_methods=True):
+    """ Start recording, and wrap the nodeobjects methods the pipeline calls. Without wrap_methods
+    only the stage() blocks are recorded, which keeps per word overhead out of the timings. """
+
+    global ENABLED, TRACE_MEMORY
+    if ENABLED:
+        return
+
+    ENABLED = True
+    TRACE_MEMORY = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if not wrap_methods:
+        return
+
+    _wrap(nodeobjects.Word, 'translated_payload', lambda word: 1)
+    _wrap(nodeobjects.Sentence, 'map_precedents_and_order', lambda sentence: sentence.word_count)
+    _wrap(nodeobjects.StoredSentence, 'map_precedents_and_order', lambda sentence: sentence.word_count)
+    _wrap(nodeobjects.Sentence, 'translated_payload', lambda sentence: sentence.word_count)
+    _wrap(nodeobjects.Sentence, 'write_payload', lambda sentence: sentence.word_count)
+    _wrap(nodeobjects.Paragraph, 'map_precedents_and_order', lambda paragraph: len(paragraph.sentences))
+    _wrap(nodeobjects.Paragraph, 'formulate_from_sentences', lambda paragraph: len(paragraph.sentences))
+    _wrap(nodeobjects.Paragraph, 'write_formatted_payload', lambda paragraph: len(paragraph.sentences))
+
+def disable():
+    """ Stop recording and restore the nodeobjects methods, the recorded stats are kept """
+
+    global ENABLED, TRACE_MEMORY
+    for (owner, attribute), original in _originals.items():
+        setattr(owner, attribute, original)
+    _originals.clear()
+
+    if TRACE_MEMORY and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    del _memory_peaks[:]
+    ENABLED = False
+    TRACE_MEMORY = False
+
+def reset():
+    _stats.clear()
+    del _events[:]
+
+def snapshot():
+    """ The recorded stats and trace events as plain data, picklable and json friendly """
+
+    return {
+        "stages": dict((name, stats.as_dict()) for name, stats in _stats.items()),
+        "events": list(_events),
+    }
+
+def merge(recorded):
+    """ Fold a snapshot() from another process into this one """
+
+    for name, values in recorded["stages"].items():
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = StageStats(name)
+        stats.calls += values["calls"]
+        stats.nodes += values["nodes"]
+        stats.seconds += values["seconds"]
+        stats.peak_bytes = max(stats.peak_bytes, values["peak_bytes"])
+
+    _events.extend(recorded["events"][:max(0, MAX_TRACE_EVENTS - len(_events))])
+
+def summary_table():
+    """ The recorded stages as a text table, slowest first """
+
+    lines = ["{:<40} {:>10} {:>12} {:>12} {:>12} {:>12}".format('stage', 'calls', 'nodes', 'total s', 'mean ms', 'peak MB')]
+    for stats in sorted(_stats.values(), key=lambda stats: stats.seconds, reverse=True):
+        lines.append("{:<40} {:>10} {:>12} {:>12.4f} {:>12.4f} {:>12.2f}".format(
+            stats.name, stats.calls, stats.nodes, stats.seconds,
+            stats.seconds * 1000 / stats.calls, stats.peak_bytes / (1024 * 1024)))
+    return '\n'.join(lines)
+
+def write_json(path):
+    with open(path, 'w') as output:
+        json.dump(snapshot()["stages"], output, indent=2)
+
+def write_chrome_trace(path):
+    """ Write the trace events in the Chrome trace event format (chrome://tracing, Perfetto) """
+
+    with open(path, 'w') as output:
+        json.dump({"traceEvents": _events, "displayTimeUnit": "ms"}, output)
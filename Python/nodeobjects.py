@@ -1,44 +1,164 @@
 # nodeobjects.py
 # This file holds our data structures used when parsing the data files.
 
+import json
+from array import array
+
+def order_by_precedents(nodes):
+    """ Link each node to its precedent and return the nodes ordered by their depth.
+
+    Builds an id -> node index so linking and ordering are linear in the number of nodes.
+    The result is identical to sorting on `depth`, ties keep their original order. """
+
+    index = {}
+    for node in nodes:
+        index[node.id] = node
+
+    for node in nodes:
+        precedent = index.get(node.precedent_id)
+        if precedent is not None:
+            node.set_precedent(precedent)
+
+    # Bucket the nodes by depth, a stable counting sort. Depths are memoized so every chain is walked once.
+    depths = [node.depth for node in nodes]
+    buckets = [[] for _ in range(max(depths, default=-1) + 1)]
+    for node, depth in zip(nodes, depths):
+        buckets[depth].append(node)
+
+    ordered = []
+    for bucket in buckets:
+        ordered.extend(bucket)
+    return ordered
+
+def translate_payload(payload):
+    """ Translate a payload from its hex encoded form """
+
+    translated_payload = payload.encode('utf-8').decode('unicode_escape').encode('utf-8')
+    return translated_payload.decode('utf-8')
+
+# Joins payloads for bulk translation. A payload holding a NUL, or ending on an odd number of
+# backslashes (an escape that would swallow the separator), is translated on its own. An escaped NUL
+# in the output shows up as a split count mismatch, the batch is then halved until the parts match.
+_PAYLOAD_SEPARATOR = '\x00'
+
+def _is_joinable(payload):
+    trailing_backslashes = len(payload) - len(payload.rstrip('\\'))
+    return trailing_backslashes % 2 == 0 and _PAYLOAD_SEPARATOR not in payload
+
+def _translate_joined(payloads):
+    if len(payloads) == 1:
+        return [translate_payload(payloads[0])]
+
+    try:
+        translated = translate_payload(_PAYLOAD_SEPARATOR.join(payloads)).split(_PAYLOAD_SEPARATOR)
+    except UnicodeError:
+        translated = None
+    if translated is not None and len(translated) == len(payloads):
+        return translated
+
+    middle = len(payloads) // 2
+    return _translate_joined(payloads[:middle]) + _translate_joined(payloads[middle:])
+
+def translate_payloads(payloads):
+    """ Translate many payloads in one decode pass, same results as translate_payload on each """
+
+    payloads = list(payloads)
+    translated = [None] * len(payloads)
+    joinable = []
+    for position, payload in enumerate(payloads):
+        if _is_joinable(payload):
+            joinable.append(position)
+        else:
+            translated[position] = translate_payload(payload)
+
+    if joinable:
+        for position, translated_payload in zip(joinable, _translate_joined([payloads[position] for position in joinable])):
+            translated[position] = translated_payload
+    return translated
+
+def translate_words(words):
+    """ Fill the translated payload cache of every word that needs it, in a single bulk pass """
+
+    pending = [word for word in words if not word.has_translated_payload()]
+    for word, translated in zip(pending, translate_payloads([word.payload for word in pending])):
+        word.set_translated_payload(translated)
+
 class CommonObject:
-    id = None
-    precedent = None
-    precedent_id = None
-    parent = None
-    parent_id = None
+    # Slots instead of a per instance __dict__, datasets hold millions of these.
+    __slots__ = ('id', 'precedent', 'precedent_id', 'parent', 'parent_id', '_depth_cache')
+
+    # Cached (generation, depth) pair. Any set_precedent bumps the shared generation, since relinking
+    # one node changes the depth of every node that follows it in the chain.
+    _depth_generation = 0
+
+    def __init__(self, id=None, precedent_id=None, parent_id=None):
+        self.id = id
+        self.precedent = None
+        self.precedent_id = precedent_id
+        self.parent = None
+        self.parent_id = parent_id
+        self._depth_cache = None
 
     def set_precedent(self, object):
         self.precedent = object
+        CommonObject._depth_generation += 1
 
     @property
     def depth(self):
         """ Retrieve the depth of this object based upon the travel length of the precedents """
-        
-        return self.get_depth(self.precedent)
+
+        generation = CommonObject._depth_generation
+        chain = []
+        walked = set()
+        current = self
+        while current is not None:
+            if current._depth_cache is not None and current._depth_cache[0] == generation:
+                break
+            if current in walked:
+                raise ValueError("Circular precedent chain found at id {}".format(current.id))
+            walked.add(current)
+            chain.append(current)
+            current = current.precedent
+
+        resulting_depth = -1 if current is None else current._depth_cache[1]
+        for link in reversed(chain):
+            resulting_depth += 1
+            link._depth_cache = (generation, resulting_depth)
+
+        return self._depth_cache[1]
 
     def get_depth(self, current_precedent=None, current_depth = 0):
-        if current_precedent:
-            resulting_depth = self.get_depth(current_precedent.precedent, current_depth + 1)
-        else:
-            resulting_depth = current_depth
+        while current_precedent:
+            current_precedent = current_precedent.precedent
+            current_depth += 1
 
-        return resulting_depth
+        return current_depth
 
 class Word(CommonObject):
-    payload = None
+    # The translated payload is cached as a (payload, translated) pair, it is only reused while
+    # the payload it was made from is still the current one.
+    __slots__ = ('payload', '_translated_cache')
+
     def __init__(self, parent_id, id, payload, precedent_id):
-        self.id = id
-        self.parent_id = parent_id
+        super().__init__(id, precedent_id, parent_id)
         self.payload = payload
-        self.precedent_id = precedent_id
+        self._translated_cache = None
+
+    def has_translated_payload(self):
+        return self._translated_cache is not None and self._translated_cache[0] is self.payload
+
+    def set_translated_payload(self, translated_payload):
+        """ Store a translation of the current payload made elsewhere, e.g. in bulk or in another process """
+
+        self._translated_cache = (self.payload, translated_payload)
 
     @property
     def translated_payload(self):
         """ Translate our payload from the hex encoded payload. """
 
-        translated_payload = self.payload.encode('utf-8').decode('unicode_escape').encode('utf-8')
-        return translated_payload.decode('utf-8')
+        if not self.has_translated_payload():
+            self._translated_cache = (self.payload, translate_payload(self.payload))
+        return self._translated_cache[1]
 
     def get_payload(self):
         return {
@@ -51,45 +171,64 @@ class Word(CommonObject):
         }
 
 class Sentence(CommonObject):
+    __slots__ = ('_words', '_word_members', '_words_by_id')
+
     def __init__(self, id, precedent_id):
-        self.id = id
-        self.precedent_id = precedent_id
+        super().__init__(id, precedent_id)
         self.words = [] # INSTANCE variable, if not list/object, is actually a shared class reference...
 
+    @property
+    def words(self):
+        return self._words
+
+    @words.setter
+    def words(self, words):
+        """ Replace the ordered word list and rebuild the id index that sits beside it """
+
+        self._words = list(words)
+        self._word_members = set(self._words)
+        self._words_by_id = {}
+        for word in self._words:
+            self._words_by_id.setdefault(word.id, word)
+
     def find_word(self, id):
-        for word in self.words:
-            if word.id == id:
-                return word
-        return None
+        return self._words_by_id.get(id)
 
     def add_word(self, word):
         if not isinstance(word, Word):
             raise ValueError("Must add instance of class Word()")
 
-        if word in self.words:
+        if word in self._word_members:
             return
 
         if word.parent_id == self.id:
             word.parent = self
-            self.words.append(word)
+            self._words.append(word)
+            self._word_members.add(word)
+            self._words_by_id.setdefault(word.id, word)
 
     def get_all_words(self):
         return self.words
 
+    @property
+    def word_count(self):
+        return len(self._words)
+
+    def translate(self):
+        """ Translate the payload of every word that needs it, in a single bulk pass """
+
+        translate_words(self.words)
+
     def map_precedents_and_order(self):
         """ Grab Word precedents and order them by their depth """
 
-        for word in self.words:
-            for precedent_word in self.words:
-                if precedent_word.precedent_id == word.id:
-                    precedent_word.set_precedent(word)
-
-        self.words = sorted(self.words, key=lambda x: x.depth, reverse=False)
+        self.words = order_by_precedents(self.words)
 
     @property
     def translated_payload(self):
         """ Create a sentence from the words array """
 
+        self.translate()
         translated_words = []
         for word in self.words:
             translated_words.append(word.translated_payload)
@@ -107,6 +246,272 @@ class Sentence(CommonObject):
             "children" : children_payloads
             }
 
+    def write_payload(self, file_object):
+        """ Stream get_payload() to a file object as json, one word at a time """
+
+        header = json.dumps({
+            "precedent": self.precedent_id,
+            "id": self.id,
+            "parent_id": self.parent_id,
+            "type": "sentence",
+            })
+        file_object.write(header[:-1] + ', "children": [')
+        for word_index, word in enumerate(self.words):
+            if word_index:
+                file_object.write(', ')
+            json.dump(word.get_payload(), file_object)
+        file_object.write(']}')
+
+    def write_translated_payload(self, file_object):
+        """ Stream translated_payload to a file object, json string escaped without the quotes """
+
+        self.translate()
+        for word_index, word in enumerate(self.words):
+            if word_index:
+                file_object.write(' ')
+            file_object.write(json.dumps(word.translated_payload)[1:-1])
+
+class WordStore:
+    """ Columnar storage for the words of a whole dataset, used instead of one Word object per word.
+
+    Ids, parent ids and precedent ids are kept in typed arrays and payloads in plain lists, so a word
+    costs a few array slots rather than an object. Non negative integer ids are stored as they are,
+    any other id is interned once and stored as a negative code. Words are addressed by row number,
+    StoredWord gives a short lived view of one row with the read side of the Word API. """
+
+    NO_ID = -1
+
+    def __init__(self):
+        self._keys = []
+        self._key_codes = {}
+        self.ids = array('q')
+        self.parent_ids = array('q')
+        self.precedent_ids = array('q')
+        self.payloads = []
+        self.translated_payloads = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        if not 0 <= row < len(self.ids):
+            raise IndexError("WordStore row {} out of range".format(row))
+        return StoredWord(self, row)
+
+    def __iter__(self):
+        for row in range(len(self.ids)):
+            yield StoredWord(self, row)
+
+    def encode_id(self, value):
+        if value is None:
+            return self.NO_ID
+        if type(value) is int and 0 <= value < 2 ** 63:
+            return value
+
+        code = self._key_codes.get(value)
+        if code is None:
+            code = -2 - len(self._keys)
+            self._keys.append(value)
+            self._key_codes[value] = code
+        return code
+
+    def find_code(self, value):
+        """ The code of an id, None when no stored word uses it """
+
+        if type(value) is int and 0 <= value < 2 ** 63:
+            return value
+        return self._key_codes.get(value)
+
+    def decode_id(self, code):
+        if code >= 0:
+            return code
+        if code == self.NO_ID:
+            return None
+        return self._keys[-2 - code]
+
+    def append(self, parent_id, id, payload, precedent_id):
+        """ Store a new word, returns its row """
+
+        self.ids.append(self.encode_id(id))
+        self.parent_ids.append(self.encode_id(parent_id))
+        self.precedent_ids.append(self.encode_id(precedent_id))
+        self.payloads.append(payload)
+        self.translated_payloads.append(None)
+        return len(self.ids) - 1
+
+    def extend(self, other):
+        """ Append every word of another WordStore, e.g. one built by a loader worker """
+
+        if other._keys:
+            for column, other_column in ((self.ids, other.ids), (self.parent_ids, other.parent_ids), (self.precedent_ids, other.precedent_ids)):
+                column.extend(self.encode_id(other.decode_id(code)) for code in other_column)
+        else:
+            self.ids.extend(other.ids)
+            self.parent_ids.extend(other.parent_ids)
+            self.precedent_ids.extend(other.precedent_ids)
+        self.payloads.extend(other.payloads)
+        self.translated_payloads.extend(other.translated_payloads)
+
+    def rows_by_parent(self):
+        """ Group the rows by parent id code, returns {code: array of rows} in row order """
+
+        groups = {}
+        for row, parent_code in enumerate(self.parent_ids):
+            rows = groups.get(parent_code)
+            if rows is None:
+                rows = groups[parent_code] = array('q')
+            rows.append(row)
+        return groups
+
+    def order_rows(self, rows):
+        """ Return the rows ordered by depth, the same order order_by_precedents gives Word objects.
+        A row's precedent is the last of the rows holding its precedent id, ties keep their order. """
+
+        index = {}
+        for position, row in enumerate(rows):
+            index[self.ids[row]] = position
+        precedents = [index.get(self.precedent_ids[row], -1) for row in rows]
+
+        # -1 is not walked yet, -2 is on the chain being walked, which makes a revisit a cycle.
+        depths = [-1] * len(rows)
+        for position in range(len(rows)):
+            chain = []
+            current = position
+            while current >= 0 and depths[current] < 0:
+                if depths[current] == -2:
+                    raise ValueError("Circular precedent chain found at id {}".format(self.decode_id(self.ids[rows[current]])))
+                depths[current] = -2
+                chain.append(current)
+                current = precedents[current]
+
+            depth = -1 if current < 0 else depths[current]
+            for link in reversed(chain):
+                depth += 1
+                depths[link] = depth
+
+        buckets = [[] for _ in range(max(depths, default=-1) + 1)]
+        for row, depth in zip(rows, depths):
+            buckets[depth].append(row)
+
+        ordered = array('q')
+        for bucket in buckets:
+            ordered.extend(bucket)
+        return ordered
+
+    def translate_rows(self, rows):
+        """ Translate the payload of every row that needs it, in a single bulk pass """
+
+        pending = [row for row in rows if self.translated_payloads[row] is None]
+        self.set_translated_payloads(pending, translate_payloads([self.payloads[row] for row in pending]))
+
+    def set_translated_payloads(self, rows, translated_payloads):
+        """ Store the translations of rows, a translation equal to its payload shares the payload string """
+
+        for row, translated_payload in zip(rows, translated_payloads):
+            payload = self.payloads[row]
+            self.translated_payloads[row] = payload if translated_payload == payload else translated_payload
+
+class StoredWord:
+    """ A view of one WordStore row with the read side of the Word API. Views are made on demand and
+    hold no state of their own, precedent links only exist while the rows are being ordered. """
+
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __eq__(self, other):
+        if not isinstance(other, StoredWord):
+            return NotImplemented
+        return self.store is other.store and self.row == other.row
+
+    def __hash__(self):
+        return hash((id(self.store), self.row))
+
+    @property
+    def id(self):
+        return self.store.decode_id(self.store.ids[self.row])
+
+    @property
+    def parent_id(self):
+        return self.store.decode_id(self.store.parent_ids[self.row])
+
+    @property
+    def precedent_id(self):
+        return self.store.decode_id(self.store.precedent_ids[self.row])
+
+    @property
+    def payload(self):
+        return self.store.payloads[self.row]
+
+    def has_translated_payload(self):
+        return self.store.translated_payloads[self.row] is not None
+
+    def set_translated_payload(self, translated_payload):
+        self.store.set_translated_payloads((self.row,), (translated_payload,))
+
+    @property
+    def translated_payload(self):
+        if not self.has_translated_payload():
+            self.store.translate_rows((self.row,))
+        return self.store.translated_payloads[self.row]
+
+    # Same fields, same order as a Word.
+    get_payload = Word.get_payload
+
+class StoredSentence(Sentence):
+    """ A Sentence whose words are rows of a WordStore. words hands out StoredWord views, ordering
+    and translation work on the rows directly. """
+
+    __slots__ = ('store', 'rows')
+
+    def __init__(self, id, precedent_id, store=None):
+        CommonObject.__init__(self, id, precedent_id)
+        self.store = store
+        self.rows = array('q')
+
+    @property
+    def words(self):
+        return [StoredWord(self.store, row) for row in self.rows]
+
+    @words.setter
+    def words(self, words):
+        """ Replace the ordered rows with those of StoredWord views of this sentence's store """
+
+        words = list(words)
+        if not all(isinstance(word, StoredWord) and word.store is self.store for word in words):
+            raise ValueError("Words of a StoredSentence must be StoredWord views of its WordStore")
+        self.rows = array('q', (word.row for word in words))
+
+    @property
+    def word_count(self):
+        return len(self.rows)
+
+    def find_word(self, id):
+        code = self.store.find_code(id)
+        if code is None:
+            return None
+        for row in self.rows:
+            if self.store.ids[row] == code:
+                return StoredWord(self.store, row)
+        return None
+
+    def add_word(self, word):
+        if not isinstance(word, StoredWord) or word.store is not self.store:
+            raise ValueError("Must add a StoredWord view of the sentence's WordStore")
+
+        if word.parent_id == self.id and word.row not in self.rows:
+            self.rows.append(word.row)
+
+    def map_precedents_and_order(self):
+        """ Order the rows by their depth """
+
+        self.rows = self.store.order_rows(self.rows)
+
+    def translate(self):
+        self.store.translate_rows(self.rows)
+
 class Paragraph:
     def __init__(self):
         self.sentences = []
@@ -114,12 +519,7 @@ class Paragraph:
     def map_precedents_and_order(self):
         """ Grab sentence precedents and order them by their depth """
 
-        for sentence in self.sentences:
-            for precedent_sentence in self.sentences:
-                if precedent_sentence.precedent_id == sentence.id:
-                    precedent_sentence.set_precedent(sentence)
-
-        self.sentences = sorted(self.sentences, key=lambda x: x.depth, reverse=False)
+        self.sentences = order_by_precedents(self.sentences)
 
     def formulate_from_sentences(self):
         """ Compile all of our sentences into this paragraph """
@@ -137,4 +537,23 @@ class Paragraph:
         return {
             "resulting_paragraph" : self.formulate_from_sentences(),
             "sentences" : formatted_payload
-        }
\ No newline at end of file
+        }
+
+    def write_formatted_payload(self, file_object):
+        """ Stream get_formatted_payload() to a file object as valid json.
+
+        Output is written sentence by sentence and word by word, so memory use does not grow with
+        the size of the document. """
+
+        file_object.write('{"resulting_paragraph": "')
+        for sentence_index, sentence in enumerate(self.sentences):
+            if sentence_index:
+                file_object.write(' ')
+            sentence.write_translated_payload(file_object)
+
+        file_object.write('", "sentences": [')
+        for sentence_index, sentence in enumerate(self.sentences):
+            if sentence_index:
+                file_object.write(', ')
+            sentence.write_payload(file_object)
+        file_object.write(']}')
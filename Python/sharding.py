@@ -0,0 +1,113 @@
+# sharding.py
+# Orders and translates sentences across a process pool.
+# Every sentence only depends on its own words, so sentences are packed into shards of plain
+# (ids, precedent ids, payloads) lists, ordered and translated in the workers, and the resulting
+# order and translations are applied back onto the Word objects, or the WordStore rows of
+# StoredSentences, in this process.
+# The workers time their ordering and translation, which are recorded as the 'order' and 'translate'
+# stages here, the same stages the single process path records.
+
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+from nodeobjects import Word, StoredSentence, order_by_precedents, translate_payloads
+
+# Roughly how many words go into one shard, large enough to keep the pickling overhead low.
+SHARD_WORDS = 50000
+
+def _order_shard(shard):
+    """ Pool worker. For every (ids, precedent_ids, payloads) sentence of the shard, returns
+    (order, precedent_positions, translated): the word positions in depth order, the position
+    of each word's precedent or -1, and the translated payloads in depth order. Also returns the
+    seconds spent ordering and translating the shard. """
+
+    results = []
+    order_seconds = translate_seconds = 0.0
+    for ids, precedent_ids, payloads in shard:
+        started = time.perf_counter()
+        words = [Word(None, word_id, payload, precedent_id) for word_id, precedent_id, payload in zip(ids, precedent_ids, payloads)]
+        positions = dict((id(word), position) for position, word in enumerate(words))
+
+        ordered = order_by_precedents(words)
+        order = [positions[id(word)] for word in ordered]
+        precedent_positions = [-1 if word.precedent is None else positions[id(word.precedent)] for word in words]
+        ordered_at = time.perf_counter()
+        translated = translate_payloads([payloads[position] for position in order])
+        order_seconds += ordered_at - started
+        translate_seconds += time.perf_counter() - ordered_at
+        results.append((order, precedent_positions, translated))
+    return results, order_seconds, translate_seconds
+
+def _make_shards(sentences, shard_words):
+    shards = []
+    shard = []
+    shard_size = 0
+    for sentence in sentences:
+        shard.append(_sentence_columns(sentence))
+        shard_size += sentence.word_count + 1
+        if shard_size >= shard_words:
+            shards.append(shard)
+            shard = []
+            shard_size = 0
+    if shard:
+        shards.append(shard)
+    return shards
+
+def _sentence_columns(sentence):
+    if isinstance(sentence, StoredSentence):
+        store = sentence.store
+        return ([store.decode_id(store.ids[row]) for row in sentence.rows],
+                [store.decode_id(store.precedent_ids[row]) for row in sentence.rows],
+                [store.payloads[row] for row in sentence.rows])
+
+    words = sentence.words
+    return [word.id for word in words], [word.precedent_id for word in words], [word.payload for word in words]
+
+def _apply_result(sentence, result):
+    order, precedent_positions, translated = result
+    if isinstance(sentence, StoredSentence):
+        # The store keeps no precedent links, only the order and the translations are applied.
+        sentence.rows = array('q', (sentence.rows[position] for position in order))
+        sentence.store.set_translated_payloads(sentence.rows, translated)
+        return
+
+    words = sentence.words
+    for word, precedent_position in zip(words, precedent_positions):
+        if precedent_position >= 0:
+            word.set_precedent(words[precedent_position])
+
+    sentence.words = [words[position] for position in order]
+    for word, translated_payload in zip(sentence.words, translated):
+        word.set_translated_payload(translated_payload)
+
+def _shard_results(shards, shard_results):
+    for shard, (results, order_seconds, translate_seconds) in zip(shards, shard_results):
+        word_count = sum(len(ids) for ids, precedent_ids, payloads in shard)
+        instrumentation.record('order', order_seconds, word_count)
+        instrumentation.record('translate', translate_seconds, word_count)
+        for result in results:
+            yield result
+
+def order_sentences(sentences, workers=None, shard_words=SHARD_WORDS):
+    """ map_precedents_and_order() and translate every sentence, sharded across a process pool.
+    The result matches ordering the sentences one by one. Falls back to doing so in this process
+    when a single worker is asked for or everything fits in one shard. Callers must run under an
+    `if __name__ == '__main__':` guard. """
+
+    word_count = sum(sentence.word_count for sentence in sentences)
+    if workers == 1 or word_count + len(sentences) <= shard_words:
+        with instrumentation.stage('order', word_count):
+            for sentence in sentences:
+                sentence.map_precedents_and_order()
+        with instrumentation.stage('translate', word_count):
+            for sentence in sentences:
+                sentence.translate()
+        return
+
+    shards = _make_shards(sentences, shard_words)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = _shard_results(shards, executor.map(_order_shard, shards))
+        for sentence, result in zip(sentences, results):
+            _apply_result(sentence, result)
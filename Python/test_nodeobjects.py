@@ -0,0 +1,130 @@
+"""
+Unit tests for the nodeobjects payload translation and the columnar word store.
+translate_payloads joins payloads into one decode pass, it must always match translate_payload on each.
+StoredSentences must order and translate their rows exactly as Sentences order Word objects.
+"""
+
+import random
+import unittest
+
+from nodeobjects import Word, Sentence, WordStore, StoredSentence, translate_payload, translate_payloads
+
+def translate_each(payloads):
+    """ translate_payload on every payload, a raised error is returned in its place """
+    results = []
+    for payload in payloads:
+        try:
+            results.append(translate_payload(payload))
+        except UnicodeError as e:
+            results.append(type(e))
+    return results
+
+class TestTranslatePayloads(unittest.TestCase):
+
+    def assertMatchesEach(self, payloads):
+        expected = translate_each(payloads)
+        failed = [result for result in expected if isinstance(result, type)]
+        if failed:
+            self.assertRaises(failed[0], translate_payloads, payloads)
+        else:
+            self.assertEqual(translate_payloads(payloads), expected)
+
+    def test_plain_payloads(self):
+        self.assertMatchesEach(['hello', 'world', '', 'caf\\u00e9'])
+
+    def test_escaped_backslash(self):
+        self.assertMatchesEach(['a\\\\', 'b', 'c\\\\\\\\', '\\\\'])
+        self.assertEqual(translate_payloads(['a\\\\', 'b']), ['a\\', 'b'])
+
+    def test_octal_null_escape(self):
+        self.assertMatchesEach(['a\\0', 'b', '\\0\\0', 'c\\000d'])
+        self.assertEqual(translate_payloads(['x\\0', 'y']), ['x\x00', 'y'])
+
+    def test_escaped_null_variants(self):
+        self.assertMatchesEach(['\\x00', 'mid\\u0000dle', '\\U00000000', '\\N{NULL}', 'plain'])
+
+    def test_named_escapes(self):
+        self.assertMatchesEach(['\\N{WHITE SMILING FACE}', 'x', '\\N{LATIN SMALL LETTER E WITH ACUTE}s'])
+
+    def test_literal_null(self):
+        self.assertMatchesEach(['a\x00b', 'c', '\x00'])
+
+    def test_truncated_hex_escape(self):
+        self.assertMatchesEach(['ok', '\\x4'])
+        self.assertMatchesEach(['\\x4', 'g'])
+        self.assertMatchesEach(['\\x4g'])
+
+    def test_trailing_backslash(self):
+        self.assertMatchesEach(['ok', 'dangling\\'])
+        self.assertMatchesEach(['three\\\\\\', 'next'])
+
+    def test_single_and_empty(self):
+        self.assertEqual(translate_payloads([]), [])
+        self.assertMatchesEach(['\\t'])
+
+    def test_mixed_batch(self):
+        payloads = ['a\\\\', '\\0', 'b\\u263a', '\\N{NULL}', 'c\\x41', 'd\\t', '\\\\\\\\', 'e']
+        self.assertMatchesEach(payloads)
+        self.assertMatchesEach(payloads * 7)
+
+def make_sentences(specs):
+    """ A Sentence of Word objects and a StoredSentence of WordStore rows from (id, precedent_id) specs """
+
+    sentence = Sentence('s', None)
+    stored_sentence = StoredSentence('s', None, WordStore())
+    for position, (word_id, precedent_id) in enumerate(specs):
+        payload = 'w{}\\u00e9'.format(position)
+        sentence.add_word(Word('s', word_id, payload, precedent_id))
+        stored_sentence.add_word(stored_sentence.store[stored_sentence.store.append('s', word_id, payload, precedent_id)])
+    return sentence, stored_sentence
+
+def word_fields(sentence):
+    return [(word.id, word.precedent_id, word.payload, word.translated_payload) for word in sentence.words]
+
+class TestStoredSentence(unittest.TestCase):
+
+    def assertOrdersAlike(self, specs):
+        sentence, stored_sentence = make_sentences(specs)
+        sentence.map_precedents_and_order()
+        stored_sentence.map_precedents_and_order()
+        self.assertEqual(word_fields(stored_sentence), word_fields(sentence))
+        self.assertEqual(stored_sentence.get_payload(), sentence.get_payload())
+
+    def test_chain(self):
+        self.assertOrdersAlike([(3, 2), (1, None), (2, 1)])
+
+    def test_mixed_ids(self):
+        self.assertOrdersAlike([('b', 'a'), ('a', -4), (-4, None), (2 ** 70, 'b'), (7, 2 ** 70)])
+
+    def test_duplicate_and_missing_precedents(self):
+        self.assertOrdersAlike([(1, None), (2, 1), (1, 9), (3, 1), (4, 'missing')])
+
+    def test_random_forests(self):
+        generator = random.Random(0)
+        for _ in range(200):
+            ids = list(range(generator.randint(0, 30)))
+            generator.shuffle(ids)
+            specs = [(word_id, generator.choice([None, 99] + ids[:position])) for position, word_id in enumerate(ids)]
+            generator.shuffle(specs)
+            self.assertOrdersAlike(specs)
+
+    def test_circular_chain(self):
+        sentence, stored_sentence = make_sentences([(1, 2), (2, 1), (3, None)])
+        with self.assertRaises(ValueError) as expected:
+            sentence.map_precedents_and_order()
+        with self.assertRaises(ValueError) as stored:
+            stored_sentence.map_precedents_and_order()
+        self.assertEqual(str(stored.exception), str(expected.exception))
+
+    def test_store_merge(self):
+        store = WordStore()
+        store.append('s', 'a', 'x', None)
+        other = WordStore()
+        other.append('s', 'b', 'y', 'a')
+        other.append(5, 6, 'z', 5)
+        store.extend(other)
+        self.assertEqual([(word.parent_id, word.id, word.precedent_id, word.payload) for word in store],
+                         [('s', 'a', None, 'x'), ('s', 'b', 'a', 'y'), (5, 6, 5, 'z')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,98 +3,305 @@
 # the MergeSort algorithm, use of classes, file IO and hex->utf8 decode.
 # Christopher Phyffer
 
-import os, json, re
-import utilities
-from node_objects import Word, Sentence, Paragraph
+import os, re, sys, glob, argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import dataloader
+import instrumentation
+import sharding
+from nodeobjects import Paragraph, WordStore, StoredWord
 
 TARGET_DATA_PATH = '.\data'
 
-# Used to determine whether the json data structure is valid, has all of our required keys.
-REQUIRED_FIELDS = ['parent_id', 'id', 'precedent', 'type']
-
-# Gather a list of data directories in the TARGET_DATA_PATH
-AVAILABLE_DIRECTORIES = []
-for f in os.listdir(TARGET_DATA_PATH):
-    if os.path.isdir(os.path.join(TARGET_DATA_PATH, f)):
-        AVAILABLE_DIRECTORIES.append(f)
-
-# Have the User select a directory from the TARGET_DATA_PATH to parse the data within
-for dir_index, data_dir in enumerate(AVAILABLE_DIRECTORIES):
-    print("{1} : {0}".format(data_dir, dir_index+1))
-
-target_dir_num = int(input("Please select the data directory #: "))
-if not 1 <= target_dir_num < len(AVAILABLE_DIRECTORIES)+1:
-    print("Specified Choice (#{}) is not valid".format(target_dir_num))
-    exit()
-
-# Specify our target directory.
-data_set_name = str(input("What should the output file name be called? (Non Alphanumeric and _ will be stripped.) "))
-data_set_name = re.sub('[^a-zA-Z0-9_]', '', data_set_name)
-if not data_set_name:
-    print("Specify a target filename and/or directory")
-    exit()
-
-# Specify the path that our file should be stored.
-path_name = str(input("Where should I write this output? (Default is the current directory) : "))
-path_name = '.' if path_name == None or path_name == '' else path_name
-try:
-    if not os.path.isdir(path_name):
-        os.mkdir(path_name)
-except OSError:
-    print ("Creation of the directory {} failed".format(path_name))
-    exit()
-else:
-    print ("Successfully created the directory {}".format(path_name))
-
-# Construct our target directory path
-TARGET_DATASET_FOLDER = os.path.join(TARGET_DATA_PATH, AVAILABLE_DIRECTORIES[target_dir_num-1])
-print("Looking into data path: `{}`".format(TARGET_DATASET_FOLDER))
-
-# Prepare our data arrays.
-sentences = []
-words = []
-
-# Gather data files from the specified data directory, make sure they are valid
-for root, dirs, files in os.walk(TARGET_DATASET_FOLDER, topdown=True, onerror=None, followlinks=False):
-    for name in files:
-        file_path = os.path.join( TARGET_DATASET_FOLDER, name)
-
-        with open(os.path.join( TARGET_DATASET_FOLDER, name), 'r') as json_output:
-            try:
-                data = json.load(json_output)
-            except:
-                raise ValueError("{} is not a valid json data format.".format(file_path))
-
-            if not utilities.is_valid_json(data, REQUIRED_FIELDS):
-                raise ValueError("{} is not a valid json data structure.".format(file_path))
-                break
-
-            if data['type'] == 'word':
-                words.append(Word(data['parent_id'], data['id'], data['payload'], data['precedent']))
-            elif data['type'] == 'sentence':
-                sentences.append(Sentence(data['id'], data['precedent']))
-
-# Add corresponding words to the sentences
-for sentence in sentences:
+# Data files are read and parsed across a pool. None uses one worker per core.
+# Processes spread the json parsing across cores, threads only overlap the file reads.
+LOADER_WORKERS = None
+LOADER_USE_PROCESSES = True
+
+# Sentences are ordered and translated across a process pool. None uses one worker per core.
+ASSEMBLY_WORKERS = None
+
+# Keep the words in a columnar WordStore instead of one Word object each, a fraction of the memory.
+COLUMNAR_WORDS = True
+
+# Orphan parent ids printed as a sample, the full list goes to the orphans file.
+ORPHAN_SAMPLE_SIZE = 10
+
+def attach_words(words, sentences):
+    """ Hand every word to the sentences matching its parent_id, in one pass over the words.
+    Returns the orphan words whose parent_id matches no sentence. """
+
+    if isinstance(words, WordStore):
+        return attach_stored_words(words, sentences)
+
+    words_by_parent = {}
     for word in words:
-        if word.parent_id == sentence.id:
+        words_by_parent.setdefault(word.parent_id, []).append(word)
+
+    for sentence in sentences:
+        for word in words_by_parent.get(sentence.id, ()):
             sentence.add_word(word)
 
-    sentence.map_precedents_and_order()
+    sentence_ids = set(sentence.id for sentence in sentences)
+    orphan_words = []
+    for parent_id, parent_words in words_by_parent.items():
+        if parent_id not in sentence_ids:
+            orphan_words.extend(parent_words)
+    return orphan_words
+
+def attach_stored_words(store, sentences):
+    """ attach_words for a WordStore and its StoredSentences, the sentences get their rows in store
+    order. Returns StoredWord views of the orphan words. """
+
+    rows_by_parent = store.rows_by_parent()
+    sentence_codes = set()
+    for sentence in sentences:
+        code = store.find_code(sentence.id)
+        if code in rows_by_parent:
+            sentence.rows = rows_by_parent[code]
+            sentence_codes.add(code)
+
+    orphan_words = []
+    for parent_code, rows in rows_by_parent.items():
+        if parent_code not in sentence_codes:
+            orphan_words.extend(StoredWord(store, row) for row in rows)
+    return orphan_words
+
+def report_orphans(orphan_words, orphans_path=None):
+    """ Print how many words have no matching sentence with a sample of their parent ids, and write
+    every orphan parent id with its word count to orphans_path, one per line """
+
+    orphan_counts = {}
+    for word in orphan_words:
+        orphan_counts[str(word.parent_id)] = orphan_counts.get(str(word.parent_id), 0) + 1
+    orphan_parents = sorted(orphan_counts)
+
+    sample = ', '.join(orphan_parents[:ORPHAN_SAMPLE_SIZE])
+    if len(orphan_parents) > ORPHAN_SAMPLE_SIZE:
+        sample += ', ...'
+    message = "{} words have no matching sentence, {} parent ids: {}".format(len(orphan_words), len(orphan_parents), sample)
+
+    if orphans_path:
+        with open(orphans_path, "w") as f:
+            for parent_id in orphan_parents:
+                f.write("{}\t{}\n".format(parent_id, orphan_counts[parent_id]))
+        message += " (full list in {})".format(orphans_path)
+    print(message)
+
+def assemble_paragraph(words, sentences, assembly_workers=1, orphans_path=None):
+    """ Attach the words to their sentences and order everything into a Paragraph.
+    Orphan words are reported, and listed in orphans_path when one is given. """
+
+    # Add corresponding words to the sentences
+    with instrumentation.stage('group', len(words)):
+        orphan_words = attach_words(words, sentences)
+    if orphan_words:
+        report_orphans(orphan_words, orphans_path)
+
+    with instrumentation.stage('assemble', len(sentences)):
+        sharding.order_sentences(sentences, assembly_workers)
+
+        # Develop our paragraph from the sentences
+        paragraph = Paragraph()
+        paragraph.sentences = sentences
+        paragraph.map_precedents_and_order()
+    return paragraph
+
+def process_dataset(dataset_folder, output_path, loader_workers=1, loader_use_processes=False, assembly_workers=1, orphans_path=None, columnar=COLUMNAR_WORDS):
+    """ Load, assemble and write out one dataset folder, returns the resulting Paragraph """
+
+    # Gather data files from the specified data directory, make sure they are valid
+    with instrumentation.stage('load') as load_stage:
+        words, sentences = dataloader.load_dataset(dataset_folder, loader_workers, loader_use_processes, columnar=columnar)
+        load_stage.add_nodes(len(words) + len(sentences))
+    paragraph = assemble_paragraph(words, sentences, assembly_workers, orphans_path)
+
+    # Output our resulting payload to the output file
+    with instrumentation.stage('write', len(sentences)):
+        with open(output_path, "w") as f:
+            paragraph.write_formatted_payload(f)
+
+    return paragraph
+
+def find_datasets(targets):
+    """ Resolve directory names, packed dataset files, glob patterns or "all" into datasets, in the given order.
+    Relative names are looked up in the TARGET_DATA_PATH when they do not exist as given. """
+
+    dataset_folders = []
+    for target in targets:
+        if target == 'all':
+            pattern = os.path.join(TARGET_DATA_PATH, '*')
+        elif glob.has_magic(target):
+            pattern = target if glob.glob(target) else os.path.join(TARGET_DATA_PATH, target)
+        elif os.path.exists(target):
+            pattern = glob.escape(target)
+        else:
+            pattern = glob.escape(os.path.join(TARGET_DATA_PATH, target))
+
+        for match in sorted(glob.glob(pattern)):
+            is_dataset = os.path.isdir(match) or dataloader.is_packed_dataset(match)
+            if is_dataset and match not in dataset_folders:
+                dataset_folders.append(match)
+
+    return dataset_folders
+
+def batch_output_names(dataset_folders):
+    """ A distinct output file name for every dataset, in the given order. Names are the dataset name
+    stripped to alphanumerics and _, packed datasets keep their extension as a _jsonl suffix, and
+    any remaining clash gets a _2, _3, ... suffix. """
+
+    output_names = []
+    used_names = set()
+    for dataset_folder in dataset_folders:
+        base_name, extension = os.path.splitext(os.path.basename(os.path.normpath(dataset_folder)))
+        if dataloader.is_packed_dataset(dataset_folder):
+            base_name += '_' + extension.lstrip('.')
+        base_name = re.sub('[^a-zA-Z0-9_]', '', base_name) or 'dataset'
+
+        data_set_name = base_name
+        suffix = 2
+        while data_set_name.lower() in used_names:
+            data_set_name = "{}_{}".format(base_name, suffix)
+            suffix += 1
+        used_names.add(data_set_name.lower())
+        output_names.append(data_set_name + ".output")
+    return output_names
+
+def _process_batch_dataset(dataset_folder, output_path, profile=False, profile_memory=False):
+    """ Pool worker, process one dataset and report (dataset_folder, output_path, error, profile snapshot) """
+
+    if profile:
+        instrumentation.reset()
+        instrumentation.enable(profile_memory)
+
+    error = None
+    try:
+        process_dataset(dataset_folder, output_path, orphans_path=os.path.splitext(output_path)[0] + ".orphans")
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    finally:
+        recorded = instrumentation.snapshot() if profile else None
+        instrumentation.disable()
+
+    return dataset_folder, output_path, error, recorded
+
+def run_batch(targets, output_dir, workers=None, profile=False, profile_memory=False):
+    """ Assemble every dataset matching the targets in parallel, one output per dataset.
+    Returns the process exit code, 0 when every dataset succeeded. """
+
+    dataset_folders = find_datasets(targets)
+    if not dataset_folders:
+        print("No data directories match {}".format(', '.join(targets)))
+        return 2
+
+    try:
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+    except OSError:
+        print("Creation of the directory {} failed".format(output_dir))
+        return 2
+
+    failures = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        output_paths = [os.path.join(output_dir, name) for name in batch_output_names(dataset_folders)]
+        pending = [executor.submit(_process_batch_dataset, folder, output_path, profile, profile_memory)
+                   for folder, output_path in zip(dataset_folders, output_paths)]
+        for future in as_completed(pending):
+            dataset_folder, output_path, error, recorded = future.result()
+            if recorded:
+                instrumentation.merge(recorded)
+            if error:
+                failures.append((dataset_folder, error))
+                print("FAILED {} : {}".format(dataset_folder, error))
+            else:
+                print("Payload written to {}".format(output_path))
+
+    print("{} of {} datasets assembled, {} failed".format(len(dataset_folders) - len(failures), len(dataset_folders), len(failures)))
+    for dataset_folder, error in failures:
+        print("  {} : {}".format(dataset_folder, error))
+
+    return 1 if failures else 0
+
+def interactive():
+    # Gather a list of data directories and packed datasets in the TARGET_DATA_PATH
+    AVAILABLE_DIRECTORIES = []
+    for f in os.listdir(TARGET_DATA_PATH):
+        f_path = os.path.join(TARGET_DATA_PATH, f)
+        if os.path.isdir(f_path) or dataloader.is_packed_dataset(f_path):
+            AVAILABLE_DIRECTORIES.append(f)
+
+    # Have the User select a directory from the TARGET_DATA_PATH to parse the data within
+    for dir_index, data_dir in enumerate(AVAILABLE_DIRECTORIES):
+        print("{1} : {0}".format(data_dir, dir_index+1))
+
+    target_dir_num = int(input("Please select the data directory #: "))
+    if not 1 <= target_dir_num < len(AVAILABLE_DIRECTORIES)+1:
+        print("Specified Choice (#{}) is not valid".format(target_dir_num))
+        exit()
+
+    # Specify our target directory.
+    data_set_name = str(input("What should the output file name be called? (Non Alphanumeric and _ will be stripped.) "))
+    data_set_name = re.sub('[^a-zA-Z0-9_]', '', data_set_name)
+    if not data_set_name:
+        print("Specify a target filename and/or directory")
+        exit()
+
+    # Specify the path that our file should be stored.
+    path_name = str(input("Where should I write this output? (Default is the current directory) : "))
+    path_name = '.' if path_name == None or path_name == '' else path_name
+    try:
+        if not os.path.isdir(path_name):
+            os.mkdir(path_name)
+    except OSError:
+        print ("Creation of the directory {} failed".format(path_name))
+        exit()
+    else:
+        print ("Successfully created the directory {}".format(path_name))
+
+    # Construct our target directory path
+    TARGET_DATASET_FOLDER = os.path.join(TARGET_DATA_PATH, AVAILABLE_DIRECTORIES[target_dir_num-1])
+    print("Looking into data path: `{}`".format(TARGET_DATASET_FOLDER))
+
+    complete_output_path = os.path.join(path_name, data_set_name + ".output")
+    orphans_path = os.path.join(path_name, data_set_name + ".orphans")
+    paragraph = process_dataset(TARGET_DATASET_FOLDER, complete_output_path, LOADER_WORKERS, LOADER_USE_PROCESSES, ASSEMBLY_WORKERS, orphans_path)
+
+    # Formulate our paragraph. Ensure that the sentences and words are ordered correctly.
+    print("Resulting Output: *{}*".format(paragraph.formulate_from_sentences()))
+    print("Payload written to {}".format(complete_output_path))
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Order data files into paragraphs. Prompts for a single dataset when no datasets are given.")
+    arg_parser.add_argument('datasets', nargs='*', help='Data directories, packed {} datasets, glob patterns or "all" (looked up in the TARGET_DATA_PATH)'.format(dataloader.PACKED_EXTENSION))
+    arg_parser.add_argument('-o', '--output-dir', default='.', help='Directory the .output files are written to')
+    arg_parser.add_argument('-j', '--workers', type=int, default=None, help='Number of datasets assembled at once, defaults to one per core')
+    arg_parser.add_argument('--profile', action='store_true', help='Record wall time, calls and node counts per stage and print a summary')
+    arg_parser.add_argument('--profile-memory', action='store_true', help='Also record peak traced memory per stage (slower), implies --profile')
+    arg_parser.add_argument('--profile-output', default=None, help='Write the per stage summary as json to this file, implies --profile')
+    arg_parser.add_argument('--trace', default=None, help='Write a Chrome trace event file to this path, implies --profile')
+    args = arg_parser.parse_args(argv)
+
+    profile = args.profile or args.profile_memory or bool(args.profile_output) or bool(args.trace)
+    if profile and not args.datasets:
+        instrumentation.enable(args.profile_memory)
 
-# Develop our paragraph from the sentences
-paragraph = Paragraph()
-paragraph.sentences = sentences
-paragraph.map_precedents_and_order()
+    if not args.datasets:
+        interactive()
+        exit_code = 0
+    else:
+        exit_code = run_batch(args.datasets, args.output_dir, args.workers, profile, args.profile_memory)
 
-# Formulate our paragraph. Ensure that the sentences and words are ordered correctly.
-print("Resulting Output: *{}*".format(paragraph.formulate_from_sentences()))
+    if profile:
+        instrumentation.disable()
+        print(instrumentation.summary_table())
+        if args.profile_output:
+            instrumentation.write_json(args.profile_output)
+            print("Profile written to {}".format(args.profile_output))
+        if args.trace:
+            instrumentation.write_chrome_trace(args.trace)
+            print("Trace written to {}".format(args.trace))
 
-# Output our resulting payload to the output file
-data_set_name += ".output"
-complete_output_path = os.path.join(path_name, data_set_name)
-f = open(complete_output_path, "w")
-f.write(str(paragraph.get_formatted_payload()))
-f.close()
+    return exit_code
 
-print("Payload written to {}".format(complete_output_path))
+if __name__ == '__main__':
+    sys.exit(main())
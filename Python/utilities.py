@@ -1,6 +1,50 @@
-# Ensures that the required fields are in the data dictionary.
-def is_valid_json(data, REQUIRED_FIELDS):
-    for req in REQUIRED_FIELDS:
-        if not req in data:
-            return False
-    return True
\ No newline at end of file
+# Types an id field may hold. bool is a subclass of int, it is rejected separately.
+ID_TYPES = (int, str)
+
+class DataValidationError(ValueError):
+    """ Raised with every (source, problem) failure found while validating a batch of records """
+
+    def __init__(self, failures):
+        self.failures = list(failures)
+        lines = ["{} is not a valid json data {}.".format(source, problem) for source, problem in self.failures]
+        if len(lines) == 1:
+            super().__init__(lines[0])
+        else:
+            super().__init__("{} invalid data records\n{}".format(len(lines), '\n'.join(lines)))
+
+def compile_validator(REQUIRED_FIELDS, type_fields=None, id_fields=('id',), optional_id_fields=('parent_id', 'precedent'), string_fields=('payload',)):
+    """ Build a validator for data dictionaries once, so checking millions of records stays cheap.
+
+    REQUIRED_FIELDS must be present on every record, type_fields maps a record "type" to the extra
+    fields that type requires. id_fields must be ints or strings, optional_id_fields may also be
+    None, string_fields must be strings when present. The returned function takes a record and
+    returns a list of problems, empty when the record is valid. """
+
+    required = frozenset(REQUIRED_FIELDS)
+    type_required = dict((record_type, frozenset(fields) | required) for record_type, fields in (type_fields or {}).items())
+    checked_ids = [(field, False) for field in id_fields] + [(field, True) for field in optional_id_fields]
+
+    def validate(data):
+        if not isinstance(data, dict):
+            return ["structure: expected an object, got {}".format(type(data).__name__)]
+
+        fields = type_required.get(data.get('type'), required)
+        if fields <= data.keys():
+            problems = []
+        else:
+            problems = ["structure: missing {}".format(', '.join(sorted(fields - data.keys())))]
+
+        for field, optional in checked_ids:
+            if field in data:
+                value = data[field]
+                if (value is None and optional) or (type(value) is not bool and isinstance(value, ID_TYPES)):
+                    continue
+                problems.append("structure: {} must be an int or string, got {}".format(field, type(value).__name__))
+
+        for field in string_fields:
+            if field in data and not isinstance(data[field], str):
+                problems.append("structure: {} must be a string, got {}".format(field, type(data[field]).__name__))
+
+        return problems
+
+    return validate